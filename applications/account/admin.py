@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from applications.account.models import User
+from applications.account.models import OutgoingEmail, User
 
 admin.site.register(User)
+admin.site.register(OutgoingEmail)
@@ -0,0 +1,113 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+
+User = get_user_model()
+
+VERSION_CLAIM = 'ver'
+
+
+def user_cache_key(user_id):
+    return f'account:user:{user_id}'
+
+
+class LocalUserCache:
+    """
+    Small per-process LRU of users with a short TTL, thread safe. Users are
+    stored and returned as copies, so a request never sees another thread's
+    changes to its request.user.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires_at, user = item
+            if expires_at < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+        return copy.copy(user)
+
+    def set(self, key, user):
+        user = copy.copy(user)
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, user)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            for key in [key for key in self.items if key[0] == user_id]:
+                del self.items[key]
+
+
+local_users = LocalUserCache(
+    settings.AUTH_USER_LOCAL_CACHE_SIZE, settings.AUTH_USER_LOCAL_CACHE_TTL
+)
+
+
+def invalidate_user(user_id):
+    """ Called on every User save/delete, other processes drop it after the local TTL """
+    # после коммита: иначе параллельный запрос успеет закешировать старую строку
+    transaction.on_commit(lambda: _drop_user(user_id))
+
+
+def _drop_user(user_id):
+    local_users.discard(user_id)
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user from a per-process LRU, then from
+    the shared cache, and only then from the database. The token is accepted
+    only while its 'ver' claim matches User.token_version, so a password change
+    revokes tokens issued before it.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise AuthenticationFailed(_('Token contained no recognizable user identification'))
+        version = validated_token.get(VERSION_CLAIM, 0)
+
+        user = local_users.get((user_id, version))
+        if user is None:
+            user = cache.get(user_cache_key(user_id))
+            if user is None:
+                user = self.load_user(user_id)
+                cache.set(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+            if user.token_version != version:
+                raise AuthenticationFailed(_('Token is no longer valid'), code='token_not_valid')
+            local_users.set((user_id, version), user)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+    def load_user(self, user_id):
+        try:
+            return User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
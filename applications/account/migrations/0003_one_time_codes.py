@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from datetime import timedelta
+
+
+def copy_activation_codes(apps, schema_editor):
+    # неактивным пользователям код приходил для активации, активным - для сброса пароля
+    User = apps.get_model('account', 'User')
+    OneTimeCode = apps.get_model('account', 'OneTimeCode')
+    now = django.utils.timezone.now()
+    OneTimeCode.objects.bulk_create([
+        OneTimeCode(
+            user_id=user_id, code=code,
+            purpose='password_reset' if is_active else 'activation',
+            expires_at=now + timedelta(seconds=(
+                settings.PASSWORD_RESET_CODE_TTL if is_active else settings.ACTIVATION_CODE_TTL
+            )),
+        )
+        for user_id, code, is_active in User.objects.exclude(activation_code='')
+        .values_list('id', 'activation_code', 'is_active').iterator()
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OneTimeCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(choices=[('activation', 'Activation'), ('password_reset', 'Password Reset')], max_length=20)),
+                ('code', models.CharField(max_length=10)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='codes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='onetimecode',
+            constraint=models.UniqueConstraint(fields=('purpose', 'code'), name='one_time_code_unique'),
+        ),
+        migrations.RunPython(copy_activation_codes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='activation_code',
+        ),
+    ]
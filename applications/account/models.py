@@ -1,5 +1,6 @@
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.db import models
+from django.utils import timezone
 
 
 class Role(models.TextChoices):
@@ -32,7 +33,10 @@ class User(AbstractBaseUser):
         max_length=13, choices=Role.choices, default=Role.null
         )
     is_authenticated = models.BooleanField(default=True)
-    activation_code = models.CharField(max_length=10, blank=True)
+    # входит в токен как claim 'ver', увеличение отзывает выданные токены.
+    # Увеличивается только при смене и сбросе пароля (serializers.py), не в
+    # set_password: его вызывает и перехеширование пароля в check_password
+    token_version = models.PositiveIntegerField(default=0)
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email']
 
@@ -47,3 +51,55 @@ class User(AbstractBaseUser):
 
     def has_perm(self, obj=None):
         return self.role == 'Администратор'
+
+
+class OutgoingEmail(models.Model):
+    """
+    Email waiting for send_queued_emails. A row stays pending until sent_at is
+    set; failed attempts push next_attempt_at forward until EMAIL_QUEUE_MAX_ATTEMPTS.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.EmailField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.to}: {self.subject}'
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'], name='email_pending_idx',
+                condition=models.Q(sent_at__isnull=True)
+            ),
+        ]
+
+
+class CodePurpose(models.TextChoices):
+    activation = 'activation'
+    password_reset = 'password_reset'
+
+
+class OneTimeCode(models.Model):
+    """
+    Code sent by email to activate an account or reset a password.
+    Consumed by a single DELETE ... RETURNING, see utils.consume_code.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='codes')
+    purpose = models.CharField(max_length=20, choices=CodePurpose.choices)
+    code = models.CharField(max_length=10)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.purpose}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['purpose', 'code'], name='one_time_code_unique'),
+        ]
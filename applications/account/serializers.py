@@ -2,9 +2,14 @@ from rest_framework import serializers, status
 from django.contrib.auth import get_user_model, password_validation
 from applications.services.models import Doctor, Service
 from django.core.validators import RegexValidator
-from applications.account.tasks import (
-    send_activation_code_task, send_drop_password_code_task)
-from applications.account.utils import create_activation_code
+from django.contrib.auth.hashers import make_password
+from django.db.models import F
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from applications.account.authentication import VERSION_CLAIM, invalidate_user
+from applications.account.models import CodePurpose
+from applications.account.utils import (
+    consume_code, create_activation_code, create_code,
+    send_activation_code, send_drop_password_code)
 
 
 User = get_user_model()
@@ -79,9 +84,7 @@ class NewUserSerializer(serializers.ModelSerializer):
                 )
             service = Service.objects.get(pk=1)
             doctor.services.add(service)
-        user_id = user.id
-        create_activation_code(user)
-        send_activation_code_task.delay(user_id)
+        send_activation_code(user, create_activation_code(user))
 
         return user
 
@@ -108,9 +111,12 @@ class ChangePasswordSerializer(serializers.Serializer):
 
     def set_new_password(self):
         new_password = self.validated_data.get('new_password')
-        user = self.context.get('request').user
-        user.set_password(new_password)
-        user.save()
+        user_id = self.context.get('request').user.pk
+        # request.user не меняем: запись идёт по pk, как при сбросе пароля
+        User.objects.filter(pk=user_id).update(
+            password=make_password(new_password), token_version=F('token_version') + 1
+        )
+        invalidate_user(user_id)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -124,21 +130,18 @@ class ActivationSerializer(serializers.Serializer):
     activation_code = serializers.CharField(max_length=10)
 
     def validate_activation_code(self, activation_code):
-        code_exists = User.objects.filter(
-            activation_code=activation_code).exists()
-
-        if code_exists:
+        # проверка и погашение кода - один DELETE ... RETURNING
+        self.user_id = consume_code(activation_code, CodePurpose.activation)
+        if self.user_id is not None:
             return activation_code
         raise serializers.ValidationError(
             {'message': 'activation code does not match'},
             code=status.HTTP_400_BAD_REQUEST)
 
     def activate(self):
-        code = self.validated_data.get('activation_code')
-        user = User.objects.get(activation_code=code)
-        user.is_active = True
-        user.activation_code = ''
-        user.save()
+        User.objects.filter(pk=self.user_id).update(is_active=True)
+        # update() не отправляет post_save
+        invalidate_user(self.user_id)
 
 
 class DropPasswordSerializer(serializers.Serializer):
@@ -146,7 +149,8 @@ class DropPasswordSerializer(serializers.Serializer):
     email = serializers.EmailField(max_length=255)
 
     def validate_email(self, email):
-        if not User.objects.filter(email=email).exists():
+        self.user_id = User.objects.filter(email=email).values_list('pk', flat=True).first()
+        if self.user_id is None:
             raise serializers.ValidationError(
                 'User with this email does not exist'
                 )
@@ -154,9 +158,7 @@ class DropPasswordSerializer(serializers.Serializer):
 
     def send_activation_code(self):
         email = self.validated_data.get('email')
-        user = User.objects.get(email=email)
-        create_activation_code(user)
-        send_drop_password_code_task.delay(email, user.activation_code)
+        send_drop_password_code(email, create_code(self.user_id, CodePurpose.password_reset))
 
 
 class ChangeForgottenPasswordSerializer(serializers.Serializer):
@@ -165,24 +167,35 @@ class ChangeForgottenPasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(max_length=128)
     password_confirm = serializers.CharField(max_length=128)
 
-    def validate_code(self, code):
-        if not User.objects.filter(activation_code=code).exists():
-            raise serializers.ValidationError({'message': 'Wrong code'})
-        return code
-
     def validate(self, attrs):
         new_pass = attrs.get('new_password')
         pass_confirm = attrs.get('password_confirm')
         if new_pass != pass_confirm:
             raise serializers.ValidationError(
                 {'message': 'Passwords do not match'})
+        # код гасится только при совпадающих паролях
+        self.user_id = consume_code(attrs.get('code'), CodePurpose.password_reset)
+        if self.user_id is None:
+            raise serializers.ValidationError({'message': 'Wrong code'})
 
         return attrs
 
     def set_new_password(self):
-        code = self._validated_data.get('code')
         new_password = self.validated_data.get('new_password')
-        user = User.objects.get(activation_code=code)
-        user.set_password(new_password)
-        user.activation_code = ''
-        user.save()
+        User.objects.filter(pk=self.user_id).update(
+            password=make_password(new_password), token_version=F('token_version') + 1
+        )
+        # update() не отправляет post_save
+        invalidate_user(self.user_id)
+
+
+class TokenObtainSerializer(TokenObtainPairSerializer):
+    """ Adds role, is_staff and the token version checked by CachedJWTAuthentication """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['role'] = user.role
+        token['is_staff'] = user.is_staff
+        token[VERSION_CLAIM] = user.token_version
+        return token
@@ -1,17 +1,86 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
 from core.celery import app
-from applications.account.utils import (
-    send_activation_code, send_drop_password_code)
-from django.contrib.auth import get_user_model
+from applications.account.models import OneTimeCode, OutgoingEmail
+from applications.account.utils import SENDING_SCHEDULED_KEY
+
+
+def _pending(batch_size):
+    return list(
+        OutgoingEmail.objects.select_for_update(skip_locked=True)
+        .filter(
+            sent_at__isnull=True,
+            next_attempt_at__lte=timezone.now(),
+            attempts__lt=settings.EMAIL_QUEUE_MAX_ATTEMPTS,
+        )[:batch_size]
+    )
+
 
-User = get_user_model()
+def _deliver(connection, emails, interval):
+    """ Send emails over an open connection, at most one per interval seconds """
+    last_sent = 0
+    for email in emails:
+        delay = last_sent + interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        last_sent = time.monotonic()
+        message = EmailMessage(
+            subject=email.subject, body=email.body,
+            from_email=email.from_email or None, to=[email.to],
+            connection=connection,
+        )
+        email.attempts += 1
+        try:
+            message.send()
+        except Exception as error:
+            email.last_error = repr(error)
+            email.next_attempt_at = timezone.now() + timedelta(
+                seconds=settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** (email.attempts - 1)
+            )
+        else:
+            email.sent_at = timezone.now()
 
 
 @app.task
-def send_activation_code_task(user_id):
-    user = User.objects.get(id=user_id)
-    send_activation_code(user)
+def send_queued_emails(batch_size=None):
+    """
+    Drain OutgoingEmail in batches over a single SMTP connection, opened only
+    when something is pending. A failed message is retried later with
+    exponential backoff, the others of the batch are still sent.
+    """
+    batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+    rate = settings.EMAIL_QUEUE_RATE_LIMIT
+    interval = 1 / rate if rate else 0
+    # письма, закоммиченные после этой точки, запланируют новый запуск
+    cache.delete(SENDING_SCHEDULED_KEY)
+    connection = None
+    try:
+        while True:
+            with transaction.atomic():
+                emails = _pending(batch_size)
+                if not emails:
+                    return
+                if connection is None:
+                    connection = get_connection(fail_silently=False)
+                    connection.open()
+                _deliver(connection, emails, interval)
+                OutgoingEmail.objects.bulk_update(
+                    emails, ['attempts', 'last_error', 'next_attempt_at', 'sent_at']
+                )
+            if len(emails) < batch_size:
+                return
+    finally:
+        if connection is not None:
+            connection.close()
 
 
 @app.task
-def send_drop_password_code_task(email, code):
-    send_drop_password_code(email, code)
+def delete_expired_codes():
+    return OneTimeCode.objects.filter(expires_at__lte=timezone.now()).delete()[0]
@@ -1,3 +1,192 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.db.models import F
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from applications.account.authentication import local_users, user_cache_key
+from applications.account.models import CodePurpose, OneTimeCode, OutgoingEmail, User
+from applications.account.tasks import delete_expired_codes, send_queued_emails
+from applications.account.utils import (
+    consume_code, create_activation_code, create_code, queue_email)
+
+
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(EMAIL_QUEUE_RATE_LIMIT=0, CACHES=LOCAL_CACHE)
+class SendQueuedEmailsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def queue(self, *recipients):
+        with mock.patch('applications.account.utils._schedule_sending'):
+            return queue_email('subject', 'body', list(recipients))
+
+    def test_batch_is_sent_over_one_connection(self):
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+        with mock.patch(
+            'applications.account.tasks.get_connection', wraps=mail.get_connection
+        ) as get_connection:
+            send_queued_emails(batch_size=2)
+
+        get_connection.assert_called_once()
+        self.assertEqual([message.to for message in mail.outbox],
+                         [['a@example.com'], ['b@example.com'], ['c@example.com']])
+        self.assertFalse(OutgoingEmail.objects.filter(sent_at__isnull=True).exists())
+
+    def test_failed_email_is_retried_later(self):
+        self.queue('a@example.com')
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('down')):
+            send_queued_emails()
+        email = OutgoingEmail.objects.get()
+        self.assertIsNone(email.sent_at)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('down', email.last_error)
+
+        # следующая попытка ещё не наступила
+        send_queued_emails()
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_no_connection_without_pending_emails(self):
+        with mock.patch('applications.account.tasks.get_connection') as get_connection:
+            send_queued_emails()
+        get_connection.assert_not_called()
+
+    @mock.patch('applications.account.tasks.send_queued_emails.apply_async')
+    def test_sending_is_scheduled_once_per_window(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email('subject', 'body', ['a@example.com'])
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email('subject', 'body', ['b@example.com'])
+        apply_async.assert_called_once_with(countdown=settings.EMAIL_QUEUE_COALESCE_WINDOW)
+
+        # запущенная задача снимает флаг - следующее письмо планирует новый запуск
+        send_queued_emails()
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email('subject', 'body', ['c@example.com'])
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class OneTimeCodeTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='user', email='user@example.com')
+
+    def test_code_is_consumed_once(self):
+        code = create_code(self.user.pk, CodePurpose.activation)
+        self.assertIsNone(consume_code(code, CodePurpose.password_reset))
+        with self.assertNumQueries(1):
+            self.assertEqual(consume_code(code, CodePurpose.activation), self.user.pk)
+        self.assertIsNone(consume_code(code, CodePurpose.activation))
+
+    def test_expired_code_is_rejected_and_cleaned_up(self):
+        code = create_code(self.user.pk, CodePurpose.activation)
+        OneTimeCode.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(consume_code(code, CodePurpose.activation))
+        self.assertEqual(delete_expired_codes(), 1)
+
+    def test_activation_flow(self):
+        with mock.patch('applications.account.utils._schedule_sending'):
+            code = create_activation_code(self.user)
+        response = self.client.post('/api/v1/auth/activate/', {'activation_code': code})
+        self.assertEqual(response.status_code, 202)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertFalse(OneTimeCode.objects.exists())
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class CachedJWTAuthenticationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_users.items.clear()
+        self.user = User(username='admin', email='admin@example.com', is_active=True, is_staff=True)
+        self.user.set_password('secret')
+        self.user.save()
+
+    def get_users(self, token):
+        return self.client.get('/api/v1/auth/users/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def obtain_token(self, password='secret'):
+        response = self.client.post('/api/token/', {'username': 'admin', 'password': password})
+        return response.data['access']
+
+    def test_user_is_loaded_once(self):
+        token = self.obtain_token()
+        self.assertEqual(AccessToken(token)['ver'], self.user.token_version)
+        self.assertTrue(AccessToken(token)['is_staff'])
+        self.assertEqual(self.get_users(token).status_code, 200)
+        # повторный запрос - только запрос самого списка, без выборки пользователя
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_users(token).status_code, 200)
+
+    def test_password_change_revokes_token(self):
+        token = self.obtain_token()
+        self.get_users(token)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/v1/auth/change-password/',
+                {'current_password': 'secret', 'new_password': 'new-secret', 'password_confirm': 'new-secret'},
+                HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_users(token).status_code, 401)
+        self.assertEqual(self.get_users(self.obtain_token('new-secret')).status_code, 200)
+
+    def test_login_with_outdated_hash_keeps_token_valid(self):
+        self.user.password = make_password('secret', hasher='pbkdf2_sha1')
+        self.user.save()
+        token = self.obtain_token()
+        self.user.refresh_from_db()
+        # check_password перехешировал пароль, версия токена не изменилась
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(AccessToken(token)['ver'], self.user.token_version)
+        self.assertEqual(self.get_users(token).status_code, 200)
+
+    def test_deactivated_user_is_rejected(self):
+        token = self.obtain_token()
+        self.get_users(token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_users(token).status_code, 401)
+
+    def test_cache_is_dropped_after_commit(self):
+        token = self.obtain_token()
+        self.get_users(token)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.save()
+        # до коммита запись в кеше остаётся - её не перезапишут старой строкой
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_cached_user_is_not_shared_between_requests(self):
+        local_users.set((self.user.pk, 0), self.user)
+        self.user.token_version = F('token_version') + 1
+        user = local_users.get((self.user.pk, 0))
+        user.is_active = False
+        self.assertEqual(local_users.get((self.user.pk, 0)).token_version, 0)
+        self.assertTrue(local_users.get((self.user.pk, 0)).is_active)
+
+    def test_activation_drops_cached_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        token = AccessToken.for_user(self.user)
+        self.assertEqual(self.get_users(token).status_code, 401)
+        code = create_code(self.user.pk, CodePurpose.activation)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/auth/activate/', {'activation_code': code})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.get_users(token).status_code, 200)
@@ -1,30 +1,112 @@
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
 from django.utils.crypto import get_random_string
-from django.core.mail import send_mail
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from kombu.exceptions import OperationalError
+
+from applications.account.models import CodePurpose, OneTimeCode, OutgoingEmail
+
+
+logger = logging.getLogger(__name__)
+
+# выставлен, пока send_queued_emails уже запланирован и ещё не начал работу
+SENDING_SCHEDULED_KEY = 'account:sending-scheduled'
+
+
+CODE_TTL = {
+    CodePurpose.activation: 'ACTIVATION_CODE_TTL',
+    CodePurpose.password_reset: 'PASSWORD_RESET_CODE_TTL',
+}
+
+
+def create_code(user_id, purpose):
+    """ New one-time code for the user, replacing the previous one of the same purpose """
+    ttl = getattr(settings, CODE_TTL[purpose])
+    with transaction.atomic():
+        OneTimeCode.objects.filter(user_id=user_id, purpose=purpose).delete()
+        code = OneTimeCode.objects.create(
+            user_id=user_id, purpose=purpose, code=get_random_string(10),
+            expires_at=timezone.now() + timedelta(seconds=ttl)
+        )
+    return code.code
+
+
+def consume_code(code, purpose):
+    """
+    Check and delete a code in one statement, returns the user id or None.
+    A code can be consumed only once even by concurrent requests.
+    """
+    table = connection.ops.quote_name(OneTimeCode._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE purpose = %s AND code = %s AND expires_at > %s '
+            f'RETURNING user_id',
+            [purpose, code, connection.ops.adapt_datetimefield_value(timezone.now())]
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
 
 
 def create_activation_code(user):
-    user.activation_code = get_random_string(10)
-    user.save()
+    return create_code(user.pk, CodePurpose.activation)
+
+
+def _schedule_sending():
+    """
+    Run send_queued_emails once per coalescing window, so emails committed by
+    many transactions go out over one SMTP connection
+    """
+    from applications.account.tasks import send_queued_emails
+
+    window = settings.EMAIL_QUEUE_COALESCE_WINDOW
+    # флаг живёт дольше окна на случай, если задача так и не запустится
+    if not cache.add(SENDING_SCHEDULED_KEY, True, timeout=window + 10):
+        return
+    try:
+        send_queued_emails.apply_async(countdown=window)
+    except OperationalError:
+        # брокер недоступен - письма отправит периодический send_queued_emails
+        cache.delete(SENDING_SCHEDULED_KEY)
+        logger.warning('Could not schedule send_queued_emails', exc_info=True)
+
+
+def queue_emails(messages):
+    """
+    Store (subject, message, recipient) triples as OutgoingEmail; they are
+    sent by send_queued_emails after the current transaction commits
+    """
+    emails = OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(
+            subject=subject, body=message,
+            from_email=settings.EMAIL_HOST_USER or '', to=recipient
+        )
+        for subject, message, recipient in messages
+    ])
+    transaction.on_commit(_schedule_sending)
+    return emails
+
+
+def queue_email(subject, message, recipient_list):
+    return queue_emails([(subject, message, recipient) for recipient in recipient_list])
 
 
-def send_activation_code(user):
+def send_activation_code(user, code):
     message = f"""
     Thank you for registration!\
-    Your activation code is {user.activation_code}"""
-    send_mail(subject='account activation',
-              message=message,
-              from_email=settings.EMAIL_HOST_USER,
-              recipient_list=[user.email],
-              fail_silently=False)
+    Your activation code is {code}"""
+    queue_email(subject='account activation',
+                message=message,
+                recipient_list=[user.email])
 
 
 def send_drop_password_code(email, code):
     message = f""" You get this message because you requested a recreating\
         new pass. code for new pass {code} """
 
-    send_mail(subject='Drop password',
-              message=message,
-              from_email=settings.EMAIL_HOST_USER,
-              recipient_list=[email],
-              fail_silently=False)
+    queue_email(subject='Drop password',
+                message=message,
+                recipient_list=[email])
@@ -1,24 +1,176 @@
+import asyncio
+from datetime import date
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from applications.services.models import Booking, Doctor
+from applications.services.serializers import DoctorScheduleSerializer
+from .utils import doctor_group
+
+
+MAX_SUBSCRIPTION_DAYS = 31
 
 
 class DoctorConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Text notifications of the doctor plus an optional live schedule view:
+    {"action": "subscribe", "date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"}
+    answers with a snapshot and then sends diffs of bookings in that range.
+
+    Only the doctor's own user or staff may connect. Outgoing messages go through a
+    bounded queue: when a slow client lets it fill up, the pending messages are
+    replaced by a single {"type": "resync"} so the client re-subscribes.
+    """
     async def connect(self):
         self.doctor_id = self.scope['url_route']['kwargs']['doctor_id']
+        self.subscription = None
+        self.sender = None
+        if not await self.is_allowed(self.scope.get('user')):
+            await self.close(code=4403)
+            return
+        self.queue = asyncio.Queue(maxsize=settings.WEBSOCKET_SEND_QUEUE_SIZE)
+        self.dropped = 0
         await self.channel_layer.group_add(
-            f"{self.doctor_id}",
+            doctor_group(self.doctor_id),
             self.channel_name
         )
         await self.accept()
+        self.sender = asyncio.create_task(self.drain())
 
     async def disconnect(self, close_code):
+        if self.sender is None:
+            return
+        self.sender.cancel()
         await self.channel_layer.group_discard(
-            f"{self.doctor_id}",
+            doctor_group(self.doctor_id),
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        pass
-         
+    @database_sync_to_async
+    def is_allowed(self, user):
+        if user is None or not user.is_authenticated or not user.is_active:
+            return False
+        if user.pk != self.doctor_id and not user.is_staff:
+            return False
+        return Doctor.objects.filter(pk=self.doctor_id).exists()
+
+    async def drain(self):
+        while True:
+            await self.send_json(await self.queue.get())
+
+    def push(self, payload):
+        """ Never blocks the channel layer: a full queue collapses into one resync """
+        if self.queue.full():
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += dropped
+            self.queue.put_nowait({'type': 'resync', 'dropped': dropped})
+        self.queue.put_nowait(payload)
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get('action') if isinstance(content, dict) else None
+        if action == 'subscribe':
+            try:
+                date_from = date.fromisoformat(content['date_from'])
+                date_to = date.fromisoformat(content['date_to'])
+            except (KeyError, TypeError, ValueError):
+                self.push({'type': 'error', 'message': 'Invalid date format'})
+                return
+            if date_to < date_from or (date_to - date_from).days >= MAX_SUBSCRIPTION_DAYS:
+                self.push({
+                    'type': 'error',
+                    'message': f'Range must be from 1 to {MAX_SUBSCRIPTION_DAYS} days'
+                })
+                return
+            self.subscription = (date_from, date_to)
+            self.push({
+                'type': 'schedule_snapshot',
+                'date_from': date_from.isoformat(),
+                'date_to': date_to.isoformat(),
+                'bookings': await self.load_schedule(date_from, date_to),
+            })
+        elif action == 'unsubscribe':
+            self.subscription = None
+
+    @database_sync_to_async
+    def load_schedule(self, date_from, date_to):
+        bookings = Booking.objects.filter(
+            doctor=self.doctor_id, date__range=(date_from, date_to)
+        ).order_by('date', 'start_time')
+        return DoctorScheduleSerializer(bookings, many=True).data
+
+    def in_subscription(self, value):
+        return self.subscription[0] <= date.fromisoformat(value) <= self.subscription[1]
+
+    def schedule_diff(self, event):
+        """ Translate a schedule_change event into a diff of the subscribed range """
+        booking = event['booking']
+        now_in = self.in_subscription(booking['date'])
+        if event['op'] == 'changed':
+            previous = event.get('previous', booking)
+            was_in = self.in_subscription(previous['date'])
+            if was_in and now_in:
+                return {'changed': [booking]}
+            if was_in:
+                return {'removed': [{'id': booking['id'], **previous}]}
+        if now_in and event['op'] in ('added', 'changed'):
+            return {'added': [booking]}
+        if now_in and event['op'] == 'removed':
+            return {'removed': [booking]}
+        return None
+
+    def schedule_frame(self, events):
+        """
+        Merge schedule_change events into one schedule_diff frame, None if nothing is visible.
+        Events of one booking collapse into its final state, so every id appears once:
+        a booking moved out of the range and back is 'changed', one added and removed
+        within the batch is not sent at all.
+        """
+        if self.subscription is None:
+            return None
+        # id -> [виден ли до первого события, последняя операция, последнее видимое состояние]
+        states = {}
+        for event in events:
+            [(op, [booking])] = (self.schedule_diff(event) or {None: [event['booking']]}).items()
+            state = states.setdefault(booking['id'], [op in ('changed', 'removed'), op, booking])
+            state[1] = op
+            if op is not None:
+                state[2] = booking
+
+        frame = {'type': 'schedule_diff', 'added': [], 'changed': [], 'removed': []}
+        for visible_before, op, booking in states.values():
+            visible_after = op in ('added', 'changed')
+            if visible_before and visible_after:
+                frame['changed'].append(booking)
+            elif visible_before:
+                frame['removed'].append(booking)
+            elif visible_after:
+                frame['added'].append(booking)
+        if not any((frame['added'], frame['changed'], frame['removed'])):
+            return None
+        return frame
 
     async def new_booking(self, event):
-        await self.send_json(event)
+        self.push(event)
+
+    async def schedule_change(self, event):
+        frame = self.schedule_frame([event])
+        if frame:
+            self.push(frame)
+
+    async def notification_batch(self, event):
+        """
+        Events coalesced by dispatch_outbox: text notifications are kept as they are,
+        schedule changes are merged into a single diff, all sent as one frame
+        """
+        frames = [item for item in event['events'] if item['type'] == 'new_booking']
+        frame = self.schedule_frame(
+            [item for item in event['events'] if item['type'] == 'schedule_change']
+        )
+        if frame:
+            frames.append(frame)
+        if frames:
+            self.push({'type': 'notification_batch', 'events': frames})
@@ -0,0 +1,43 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from applications.account.authentication import CachedJWTAuthentication
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Sets scope['user'] from a simplejwt access token passed as ?token=...
+    (browsers cannot set headers on websockets) or in the Authorization header.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.get_user(self.get_raw_token(scope))
+        return await super().__call__(scope, receive, send)
+
+    def get_raw_token(self, scope):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if token:
+            return token[0]
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                parts = value.decode().split()
+                if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                    return parts[1]
+        return None
+
+    @database_sync_to_async
+    def get_user(self, raw_token):
+        if raw_token is None:
+            return AnonymousUser()
+        authentication = CachedJWTAuthentication()
+        try:
+            validated_token = authentication.get_validated_token(raw_token)
+            return authentication.get_user(validated_token)
+        except (InvalidToken, AuthenticationFailed):
+            return AnonymousUser()
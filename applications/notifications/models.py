@@ -1,3 +1,17 @@
 from django.db import models
 
-# Create your models here.
+
+class OutboxMessage(models.Model):
+    """
+    Channel layer message written in the same transaction as the change it
+    describes; dispatch_outbox publishes it after commit and deletes the row.
+    """
+    group = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'{self.group}: {self.payload.get("type")}'
+
+    class Meta:
+        ordering = ['id']
@@ -0,0 +1,56 @@
+from asgiref.sync import async_to_sync
+from celery import shared_task
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import OutboxMessage
+from .utils import DISPATCH_SCHEDULED_KEY, count_notifications
+
+
+def coalesce(messages):
+    """
+    Group outbox messages by channel group keeping their order.
+    A group with several messages gets one notification_batch payload.
+    """
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.group, []).append(message.payload)
+    return [
+        (group, payloads[0] if len(payloads) == 1 else {
+            "type": "notification_batch", "events": payloads
+        })
+        for group, payloads in groups.items()
+    ]
+
+
+async def _publish(channel_layer, batches):
+    for group, payload in batches:
+        await channel_layer.group_send(group, payload)
+
+
+@shared_task
+def dispatch_outbox(batch_size=None):
+    """
+    Publish pending outbox messages in batches, one group_send per doctor group
+    and batch. Rows are deleted only after group_send succeeded, so every
+    committed message is delivered at least once.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_OUTBOX_BATCH_SIZE
+    channel_layer = get_channel_layer()
+    # сообщения, закоммиченные после этой точки, запланируют новый запуск
+    cache.delete(DISPATCH_SCHEDULED_KEY)
+    while True:
+        with transaction.atomic():
+            messages = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not messages:
+                return
+            batches = coalesce(messages)
+            async_to_sync(_publish)(channel_layer, batches)
+            OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).delete()
+        count_notifications(len(batches), len(messages) - len(batches))
+        if len(messages) < batch_size:
+            return
@@ -1,3 +1,202 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from applications.account.models import User
+from applications.services.models import Doctor
+from .consumers import DoctorConsumer
+from .middleware import JWTAuthMiddleware
+from .models import OutboxMessage
+from .routing import websocket_urlpatterns
+from .tasks import dispatch_outbox
+from .utils import doctor_group, doctor_message, enqueue_messages, notification_stats
+
+
+WEBSOCKET_SETTINGS = {
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+}
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DispatchOutboxTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('applications.notifications.tasks._publish')
+    def test_messages_of_one_group_are_coalesced(self, publish):
+        with mock.patch('applications.notifications.utils._schedule_dispatch'):
+            enqueue_messages([doctor_message(1, 'a'), doctor_message(2, 'b'), doctor_message(1, 'c')])
+        dispatch_outbox()
+
+        batches = publish.call_args.args[1]
+        self.assertEqual(batches, [
+            ('doctor.1', {'type': 'notification_batch', 'events': [
+                {'type': 'new_booking', 'message': 'a'},
+                {'type': 'new_booking', 'message': 'c'},
+            ]}),
+            ('doctor.2', {'type': 'new_booking', 'message': 'b'}),
+        ])
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(notification_stats(), {'sent': 2, 'coalesced': 1})
+
+    @mock.patch('applications.notifications.tasks.dispatch_outbox.apply_async')
+    def test_dispatch_is_scheduled_once_per_window(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_messages([doctor_message(1, 'a')])
+            enqueue_messages([doctor_message(1, 'b')])
+        apply_async.assert_called_once()
+
+    @mock.patch('applications.notifications.tasks._publish', side_effect=ConnectionError)
+    def test_failed_publish_keeps_messages(self, publish):
+        with mock.patch('applications.notifications.utils._schedule_dispatch'):
+            enqueue_messages([doctor_message(1, 'a')])
+        with self.assertRaises(ConnectionError):
+            dispatch_outbox()
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_rolled_back_messages_are_not_scheduled(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                enqueue_messages([doctor_message(1, 'a')])
+                raise ValueError
+        self.assertEqual(callbacks, [])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+@override_settings(**WEBSOCKET_SETTINGS)
+class DoctorConsumerTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        self.users = []
+        for number in range(2):
+            user = User.objects.create(username=f'doctor{number}', email=f'doctor{number}@test.com', is_active=True)
+            Doctor.objects.create(
+                user=user, name='Doctor', last_name=f'{number}',
+                phone_number='+996555000001', profession='Therapist')
+            self.users.append(user)
+
+    async def connect(self, token=None, doctor=None):
+        doctor = doctor or self.users[0]
+        path = f'/ws/doctors/{doctor.pk}/' + (f'?token={token}' if token else '')
+        communicator = WebsocketCommunicator(self.application, path)
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+
+class DoctorConsumerAuthTest(DoctorConsumerTestCase):
+
+    async def test_anonymous_and_invalid_tokens_are_rejected(self):
+        for token in (None, 'not-a-token'):
+            communicator, connected, code = await self.connect(token)
+            self.assertFalse(connected)
+            self.assertEqual(code, 4403)
+
+    async def test_token_of_another_user_is_rejected(self):
+        communicator, connected, code = await self.connect(AccessToken.for_user(self.users[1]))
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+    async def test_own_token_is_accepted(self):
+        doctor = self.users[0]
+        communicator, connected, code = await self.connect(AccessToken.for_user(doctor))
+        self.assertTrue(connected)
+        await get_channel_layer().group_send(
+            doctor_group(doctor.pk), {'type': 'new_booking', 'message': 'hello'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'new_booking', 'message': 'hello'})
+        await communicator.disconnect()
+
+
+class DoctorConsumerScheduleTest(DoctorConsumerTestCase):
+
+    @staticmethod
+    def change(op, booking_id, day, previous_day=None):
+        event = {'type': 'schedule_change', 'op': op, 'booking': {'id': booking_id, 'date': day}}
+        if previous_day:
+            event['previous'] = {'date': previous_day}
+        return event
+
+    async def subscribe(self, doctor):
+        communicator, connected, code = await self.connect(AccessToken.for_user(doctor), doctor)
+        self.assertTrue(connected)
+        await communicator.send_json_to(
+            {'action': 'subscribe', 'date_from': '2030-01-01', 'date_to': '2030-01-07'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'schedule_snapshot')
+        return communicator
+
+    async def test_changes_arrive_as_diffs_of_the_subscription(self):
+        doctor = self.users[0]
+        communicator = await self.subscribe(doctor)
+        group = doctor_group(doctor.pk)
+        for event, diff in [
+            (self.change('added', 1, '2030-01-02'), {'added': [{'id': 1, 'date': '2030-01-02'}]}),
+            (self.change('changed', 1, '2030-01-03', '2030-01-02'), {'changed': [{'id': 1, 'date': '2030-01-03'}]}),
+            # перенос за пределы подписки - удаление со старой датой
+            (self.change('changed', 1, '2030-02-01', '2030-01-03'), {'removed': [{'id': 1, 'date': '2030-01-03'}]}),
+            (self.change('changed', 2, '2030-01-04', '2030-02-01'), {'added': [{'id': 2, 'date': '2030-01-04'}]}),
+            (self.change('removed', 2, '2030-01-04'), {'removed': [{'id': 2, 'date': '2030-01-04'}]}),
+        ]:
+            await get_channel_layer().group_send(group, event)
+            self.assertEqual(await communicator.receive_json_from(), {
+                'type': 'schedule_diff', 'added': [], 'changed': [], 'removed': [], **diff})
+
+        # события вне подписки не отправляются
+        await get_channel_layer().group_send(group, self.change('added', 3, '2030-03-01'))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_batch_sends_final_state_per_booking(self):
+        doctor = self.users[0]
+        communicator = await self.subscribe(doctor)
+
+        await get_channel_layer().group_send(doctor_group(doctor.pk), {
+            'type': 'notification_batch', 'events': [
+                # 1 перенесли за пределы подписки и обратно
+                self.change('changed', 1, '2030-02-01', '2030-01-02'),
+                self.change('changed', 1, '2030-01-03', '2030-02-01'),
+                # 2 создана и удалена в одном окне
+                self.change('added', 2, '2030-01-04'),
+                self.change('removed', 2, '2030-01-04'),
+                # 3 создана и изменена
+                self.change('added', 3, '2030-01-05'),
+                self.change('changed', 3, '2030-01-06', '2030-01-05'),
+                # 4 уехала из подписки
+                self.change('changed', 4, '2030-03-01', '2030-01-02'),
+            ],
+        })
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame, {'type': 'notification_batch', 'events': [{
+            'type': 'schedule_diff',
+            'added': [{'id': 3, 'date': '2030-01-06'}],
+            'changed': [{'id': 1, 'date': '2030-01-03'}],
+            'removed': [{'id': 4, 'date': '2030-01-02'}],
+        }]})
+        await communicator.disconnect()
+
+
+class DoctorConsumerQueueTest(TestCase):
+
+    def test_full_queue_collapses_into_resync(self):
+        consumer = DoctorConsumer()
+        consumer.queue = asyncio.Queue(maxsize=3)
+        consumer.dropped = 0
+        for number in range(5):
+            consumer.push({'type': 'new_booking', 'message': str(number)})
+        frames = [consumer.queue.get_nowait() for _ in range(consumer.queue.qsize())]
+        # 0-2 заполнили очередь, на 3 она сброшена в resync
+        self.assertEqual(frames, [
+            {'type': 'resync', 'dropped': 3},
+            {'type': 'new_booking', 'message': '3'},
+            {'type': 'new_booking', 'message': '4'},
+        ])
+        self.assertEqual(consumer.dropped, 3)
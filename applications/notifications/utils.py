@@ -0,0 +1,87 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from kombu.exceptions import OperationalError
+
+from .models import OutboxMessage
+
+
+logger = logging.getLogger(__name__)
+
+# выставлен, пока dispatch_outbox уже запланирован и ещё не начал работу
+DISPATCH_SCHEDULED_KEY = 'notifications:dispatch-scheduled'
+SENT_COUNTER_KEY = 'notifications:sent'
+COALESCED_COUNTER_KEY = 'notifications:coalesced'
+
+
+def doctor_group(doctor_id):
+    return f'doctor.{doctor_id}'
+
+
+def _schedule_dispatch():
+    """
+    Run dispatch_outbox once per coalescing window: every message committed
+    before it starts is published together with the others for the same doctor
+    """
+    from .tasks import dispatch_outbox
+
+    window = settings.NOTIFICATION_COALESCE_WINDOW
+    # флаг живёт дольше окна на случай, если задача так и не запустится
+    if not cache.add(DISPATCH_SCHEDULED_KEY, True, timeout=window + 10):
+        return
+    try:
+        dispatch_outbox.apply_async(countdown=window)
+    except OperationalError:
+        # брокер недоступен - сообщения заберёт периодический dispatch_outbox
+        cache.delete(DISPATCH_SCHEDULED_KEY)
+        logger.warning('Could not schedule dispatch_outbox', exc_info=True)
+
+
+def count_notifications(sent, coalesced):
+    """ sent - group_send calls, coalesced - outbox messages folded into batches """
+    for key, value in ((SENT_COUNTER_KEY, sent), (COALESCED_COUNTER_KEY, coalesced)):
+        if value:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, value)
+
+
+def notification_stats():
+    counters = cache.get_many([SENT_COUNTER_KEY, COALESCED_COUNTER_KEY])
+    return {
+        'sent': counters.get(SENT_COUNTER_KEY, 0),
+        'coalesced': counters.get(COALESCED_COUNTER_KEY, 0),
+    }
+
+
+def enqueue_messages(messages):
+    """
+    Write (group, payload) pairs to the outbox of the current transaction,
+    they are published only if it commits
+    """
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(group=group, payload=payload) for group, payload in messages
+    ])
+    transaction.on_commit(_schedule_dispatch)
+
+
+def doctor_message(doctor_id, message):
+    """ Text notification for every socket of the doctor (see DoctorConsumer.new_booking) """
+    return doctor_group(doctor_id), {"type": "new_booking", "message": message}
+
+
+def send_doctor_message(doctor_id, message):
+    enqueue_messages([doctor_message(doctor_id, message)])
+
+
+def schedule_event(doctor_id, op, booking, previous=None):
+    """
+    Structured schedule change for DoctorConsumer.schedule_change.
+    op is 'added', 'changed' or 'removed'; previous holds the old date and times
+    of a changed booking.
+    """
+    payload = {"type": "schedule_change", "op": op, "booking": booking}
+    if previous is not None:
+        payload["previous"] = previous
+    return doctor_group(doctor_id), payload
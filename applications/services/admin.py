@@ -3,7 +3,7 @@ from django.contrib import admin
 from .models import (
     Service, ServiceHistory, 
     Booking, Patient, 
-    Doctor
+    Doctor, WorkingHours
 )
 
-admin.site.register([Service, ServiceHistory, Booking, Patient, Doctor])
\ No newline at end of file
+admin.site.register([Service, ServiceHistory, Booking, Patient, Doctor, WorkingHours])
\ No newline at end of file
@@ -0,0 +1,77 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from .models import Booking, WorkingHours
+
+
+MAX_RANGE_DAYS = 31
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def free_intervals(working, busy):
+    """
+    Subtract busy intervals from working intervals in a single pass.
+    Both lists contain (start, end) pairs sorted by start.
+    """
+    free = []
+    j = 0
+    for work_start, work_end in working:
+        cursor = work_start
+        while j < len(busy) and busy[j][1] <= cursor:
+            j += 1
+        while j < len(busy) and busy[j][0] < work_end:
+            busy_start, busy_end = busy[j]
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            if busy_end > work_end:
+                # запись заходит в следующий рабочий интервал
+                break
+            j += 1
+        if cursor < work_end:
+            free.append((cursor, work_end))
+    return free
+
+
+def load_intervals(doctor_ids, date_from, date_to):
+    """
+    Working hours by (doctor, weekday) and bookings by (doctor, date),
+    both sorted by start, in two queries for any number of doctors
+    """
+    working = defaultdict(list)
+    hours = WorkingHours.objects.filter(doctor__in=doctor_ids).order_by(
+        'doctor', 'weekday', 'start_time'
+    ).values_list('doctor', 'weekday', 'start_time', 'end_time')
+    for doctor_id, weekday, start_time, end_time in hours:
+        working[doctor_id, weekday].append((start_time, end_time))
+
+    busy = defaultdict(list)
+    bookings = Booking.objects.filter(
+        doctor__in=doctor_ids, date__range=(date_from, date_to)
+    ).order_by('doctor', 'date', 'start_time').values_list('doctor', 'date', 'start_time', 'end_time')
+    for doctor_id, day, start_time, end_time in bookings:
+        busy[doctor_id, day].append((start_time, end_time))
+    return working, busy
+
+
+def get_availability(doctor, date_from, date_to, service=None):
+    """ Free intervals of a doctor for every day in [date_from, date_to] """
+    working, busy = load_intervals([doctor.pk], date_from, date_to)
+
+    min_length = service.duration if service else 0
+    days = []
+    day = date_from
+    while day <= date_to:
+        free = [
+            {'start': start, 'end': end}
+            for start, end in free_intervals(
+                working[doctor.pk, day.weekday()], busy[doctor.pk, day]
+            )
+            if _minutes(end) - _minutes(start) >= min_length
+        ]
+        days.append({'date': day, 'free': free})
+        day += timedelta(days=1)
+    return days
@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework import serializers
+
+from applications.notifications.utils import doctor_message, enqueue_messages, schedule_event
+
+from .conflicts import OVERLAP_MESSAGE, is_overlap_error
+from .history import upsert_service_history
+from .matrix import drop_doctor_weeks
+from .models import Booking, ServiceHistory
+from .serializers import DoctorScheduleSerializer
+from .stats import record_bookings, record_confirmations
+
+
+def _notify_doctors(bookings, summary, op):
+    """ One text message per doctor instead of one per booking, plus schedule changes """
+    by_doctor = defaultdict(list)
+    for booking in bookings:
+        by_doctor[booking.doctor].append(booking)
+    messages = []
+    for doctor, items in by_doctor.items():
+        details = '; '.join(
+            f"{booking.date} from {booking.start_time} to {booking.end_time} "
+            f"'{booking.service.name}', patient {booking.patient.name} {booking.patient.last_name}"
+            for booking in items
+        )
+        messages.append(doctor_message(
+            doctor.user_id,
+            f"{doctor.name} {doctor.last_name}, {summary(len(items))}: {details}"
+        ))
+        messages += [
+            schedule_event(doctor.user_id, op, dict(DoctorScheduleSerializer(booking).data))
+            for booking in items
+        ]
+    enqueue_messages(messages)
+
+
+def create_bookings(bookings):
+    """
+    Insert already validated bookings and their history with bulk_create.
+    bulk_create skips Booking.save and the signals, so their work is done here once.
+    """
+    try:
+        with transaction.atomic():
+            Booking.objects.bulk_create(bookings)
+            upsert_service_history(bookings)
+            record_bookings(bookings)
+            _notify_doctors(bookings, lambda count: f'you have {count} new bookings', 'added')
+            drop_doctor_weeks([(booking.doctor_id, booking.date) for booking in bookings])
+    except IntegrityError as error:
+        if is_overlap_error(error):
+            raise serializers.ValidationError({'message': OVERLAP_MESSAGE})
+        raise
+    return bookings
+
+
+def confirm_bookings(ids):
+    """
+    Confirm bookings with a single UPDATE, already confirmed ones are skipped.
+    The rows are locked while they are read, so a concurrent confirmation of the
+    same ids waits and then finds them confirmed instead of counting them again.
+    """
+    with transaction.atomic():
+        bookings = list(
+            Booking.objects.select_for_update(of=('self',)).select_related(
+                'doctor', 'service', 'patient').filter(pk__in=ids, confirmed=False)
+        )
+        pks = [booking.pk for booking in bookings]
+        Booking.objects.filter(pk__in=pks).update(confirmed=True, updated_at=timezone.now())
+        ServiceHistory.objects.filter(booking__in=pks).update(confirmed=True)
+        record_confirmations(bookings)
+        for booking in bookings:
+            booking.confirmed = True
+        _notify_doctors(bookings, lambda count: f'{count} of your bookings were confirmed', 'changed')
+    return bookings
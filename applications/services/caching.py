@@ -0,0 +1,106 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Sum
+from django.utils.http import http_date, parse_etags
+from rest_framework.response import Response
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+PATIENTS_VERSION_KEY = 'patients:version'
+
+
+def make_etag(value) -> str:
+    return '"%s"' % hashlib.sha1(str(value).encode()).hexdigest()
+
+
+def etag_matches(request, etag) -> bool:
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags or f'W/{etag}' in etags
+
+
+def not_modified(etag):
+    return Response(status=304, headers={'ETag': etag})
+
+
+def bookings_fingerprint(queryset, versions=()):
+    """
+    ETag and Last-Modified of a set of bookings from one aggregate query.
+    Count and sum of ids change on insert/delete, max(updated_at) on update.
+    Responses that nest related rows pass their versions, e.g. catalog_version().
+    """
+    stats = queryset.order_by().aggregate(
+        count=Count('id'), ids=Sum('id'), last=Max('updated_at'))
+    etag = make_etag(':'.join(map(str, [stats['count'], stats['ids'], stats['last'], *versions])))
+    headers = {'ETag': etag}
+    if stats['last'] is not None:
+        headers['Last-Modified'] = http_date(stats['last'].timestamp())
+    return etag, headers
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        # новая версия не должна совпасть с вытесненной старой
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def catalog_version():
+    return _version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    _bump_version(CATALOG_VERSION_KEY)
+
+
+def patients_version():
+    return _version(PATIENTS_VERSION_KEY)
+
+
+def bump_patients_version():
+    _bump_version(PATIENTS_VERSION_KEY)
+
+
+class CatalogCacheMixin:
+    """
+    Caches list and retrieve responses under the current catalog version and
+    answers If-None-Match with 304. Catalog changes bump the version (signals.py).
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = f'catalog:{catalog_version()}:{request.get_full_path()}'
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = json.dumps(response.data, cls=DjangoJSONEncoder, sort_keys=True)
+            entry = (make_etag(body), response.data)
+            cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+
+        etag, data = entry
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        return Response(data, headers={'ETag': etag})
@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+from django.db import IntegrityError
+
+
+# Имя ограничения (PostgreSQL) и триггеров (SQLite) из миграции 0002
+OVERLAP_CONSTRAINT = 'booking_no_overlap'
+OVERLAP_MESSAGE = 'Для этого времени уже есть запись.'
+
+
+def is_overlap_error(error: IntegrityError) -> bool:
+    """ True if the database rejected a row because it overlaps another booking """
+    return OVERLAP_CONSTRAINT in str(error)
+
+
+def find_conflicts(bookings):
+    """
+    Indexes of new (unsaved) bookings that overlap another booking of the batch
+    or an existing one. Existing bookings are loaded with a single range query.
+    """
+    from .models import Booking
+
+    if not bookings:
+        return []
+    dates = [booking.date for booking in bookings]
+    existing = Booking.objects.filter(
+        doctor__in={booking.doctor_id for booking in bookings},
+        date__range=(min(dates), max(dates)),
+    ).values_list('doctor', 'date', 'start_time', 'end_time')
+
+    slots = defaultdict(list)
+    for doctor_id, date, start_time, end_time in existing:
+        slots[doctor_id, date].append((start_time, end_time, None))
+    for index, booking in enumerate(bookings):
+        slots[booking.doctor_id, booking.date].append(
+            (booking.start_time, booking.end_time, index))
+
+    conflicts = set()
+    for intervals in slots.values():
+        intervals.sort(key=lambda interval: (interval[0], interval[1]))
+        latest_end, owner = None, None
+        for start_time, end_time, index in intervals:
+            if latest_end is not None and start_time < latest_end:
+                conflicts.update(i for i in (index, owner) if i is not None)
+            if latest_end is None or end_time > latest_end:
+                latest_end, owner = end_time, index
+    return sorted(conflicts)
@@ -0,0 +1,77 @@
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ServiceHistory
+
+
+EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('date', 'date'),
+    ('start_time', 'start_time'),
+    ('end_time', 'end_time'),
+    ('confirmed', 'confirmed'),
+    ('booking', 'booking_id'),
+    ('patient_name', 'patient__name'),
+    ('patient_last_name', 'patient__last_name'),
+    ('doctor_name', 'doctor__name'),
+    ('doctor_last_name', 'doctor__last_name'),
+    ('service', 'service__name'),
+    ('price', 'service__price'),
+)
+
+
+class Echo:
+    """ File-like object for csv.writer that returns the line instead of storing it """
+
+    def write(self, value):
+        return value
+
+
+async def history_rows(date_from=None, date_to=None, doctor=None, chunk_size=2000):
+    """
+    Async iterator over tuples of EXPORT_COLUMNS in date order. values_list joins
+    the related names in the same query and iterator() reads it with a server-side
+    cursor where the database supports one, so memory use does not grow with the table.
+    """
+    queryset = ServiceHistory.objects.all()
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    if doctor:
+        queryset = queryset.filter(doctor=doctor)
+    rows = queryset.order_by('date', 'start_time', 'id').values_list(
+        *(lookup for _, lookup in EXPORT_COLUMNS)
+    ).iterator(chunk_size=chunk_size)
+    # values_list().aiterator() в Django 4.2 выполняет запрос прямо в event loop,
+    # поэтому пачки читаем сами в потоке для синхронного ORM
+    while True:
+        chunk = await sync_to_async(_next_chunk)(rows, chunk_size)
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            break
+
+
+def _next_chunk(rows, size):
+    return list(islice(rows, size))
+
+
+# Асинхронные генераторы: HTTP обслуживает ASGI (core/asgi.py), а там Django
+# целиком собирает в память синхронный итератор StreamingHttpResponse
+async def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    async for row in rows:
+        yield writer.writerow(row)
+
+
+async def ndjson_lines(rows):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    encoder = DjangoJSONEncoder()
+    async for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + '\n'
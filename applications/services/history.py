@@ -0,0 +1,29 @@
+from .models import Booking, ServiceHistory
+
+
+def upsert_service_history(bookings):
+    """
+    Create or update the history rows of saved bookings with a single
+    INSERT ... ON CONFLICT (booking_id) DO UPDATE statement
+    """
+    ServiceHistory.objects.bulk_create(
+        [
+            ServiceHistory(
+                booking_id=booking.pk,
+                patient_id=booking.patient_id,
+                doctor_id=booking.doctor_id,
+                service_id=booking.service_id,
+                date=booking.date,
+                confirmed=booking.confirmed,
+                start_time=booking.start_time,
+                end_time=booking.end_time
+            )
+            for booking in bookings
+        ],
+        update_conflicts=True,
+        unique_fields=['booking'],
+        update_fields=[
+            'patient', 'doctor', 'service', 'date',
+            'confirmed', 'start_time', 'end_time'
+        ],
+    )
@@ -0,0 +1,101 @@
+import csv
+import re
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.validators import validate_email
+from django.core.exceptions import ValidationError
+
+from .models import Patient, normalize_phone, phone_regex
+
+
+REQUIRED_COLUMNS = ('name', 'last_name', 'phone_number')
+MAX_REPORTED_ERRORS = 100
+
+_phone = re.compile(phone_regex.regex.pattern)
+_phone_separators = re.compile(r'[\s()-]')
+_name_length = Patient._meta.get_field('name').max_length
+_last_name_length = Patient._meta.get_field('last_name').max_length
+_phone_length = Patient._meta.get_field('phone_number').max_length
+_email_length = Patient._meta.get_field('email').max_length
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _row_error(row):
+    """ Cheap checks of one CSV row, the same rules PatientSerializer applies """
+    name, last_name = row.get('name') or '', row.get('last_name') or ''
+    if not name or not last_name:
+        return 'name and last_name are required'
+    if len(name) > _name_length or len(last_name) > _last_name_length:
+        return 'name or last_name is too long'
+    if not _phone.match(row.get('phone_number') or ''):
+        return phone_regex.message
+    # регулярное выражение допускает до 19 символов, колонка - max_length
+    if len(row['phone_number']) > _phone_length:
+        return f'phone_number must be at most {_phone_length} characters'
+    if len(row.get('email') or '') > _email_length:
+        return 'email is too long'
+    if row.get('email'):
+        try:
+            validate_email(row['email'])
+        except ValidationError:
+            return 'invalid email'
+    return None
+
+
+def import_patients(lines, batch_size=None):
+    """
+    Import patients from CSV lines (name, last_name, phone_number[, email]).
+    Rows are validated and deduplicated a batch at a time: one indexed
+    phone_normalized lookup per batch finds existing patients and each batch
+    is inserted with a single bulk_create. Lines are read lazily, so any
+    file size is handled in constant memory.
+    """
+    batch_size = batch_size or settings.PATIENT_IMPORT_BATCH_SIZE
+    reader = csv.DictReader(lines)
+    missing = set(REQUIRED_COLUMNS) - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f'Missing columns: {", ".join(sorted(missing))}')
+
+    started = time.monotonic()
+    result = {'rows': 0, 'created': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+    for batch in _batches(enumerate(reader, start=2), batch_size):
+        result['rows'] += len(batch)
+        candidates = {}
+        for line, row in batch:
+            row = {key: (value or '').strip() for key, value in row.items() if key}
+            # '+996 (555) 12-34-56' хранится так же, как введённый через API '+99655512...'
+            row['phone_number'] = _phone_separators.sub('', row.get('phone_number', ''))
+            error = _row_error(row)
+            if error:
+                result['invalid'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append({'line': line, 'error': error})
+                continue
+            phone = normalize_phone(row['phone_number'])
+            if phone in candidates:
+                result['duplicates'] += 1
+                continue
+            candidates[phone] = Patient(
+                name=row['name'], last_name=row['last_name'],
+                phone_number=row['phone_number'], email=row.get('email', ''),
+                phone_normalized=phone,
+            )
+
+        existing = set(Patient.objects.filter(
+            phone_normalized__in=list(candidates)
+        ).values_list('phone_normalized', flat=True))
+        new = [patient for phone, patient in candidates.items() if phone not in existing]
+        result['duplicates'] += len(candidates) - len(new)
+        Patient.objects.bulk_create(new)
+        result['created'] += len(new)
+
+    result['seconds'] = round(time.monotonic() - started, 3)
+    result['rows_per_second'] = round(result['rows'] / result['seconds']) if result['seconds'] else result['rows']
+    return result
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from applications.services.history import upsert_service_history
+from applications.services.models import Booking, ServiceHistory
+
+
+class Command(BaseCommand):
+    help = 'Link existing ServiceHistory rows to their bookings and reconcile them, in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        linked = processed = 0
+        while True:
+            bookings = list(Booking.objects.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not bookings:
+                break
+            last_pk = bookings[-1].pk
+            with transaction.atomic():
+                linked += self.link_chunk(bookings)
+                upsert_service_history(bookings)
+            processed += len(bookings)
+            self.stdout.write(f'{processed} bookings processed, {linked} history rows linked')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {processed} bookings, {linked} history rows linked'))
+
+    def link_chunk(self, bookings):
+        """
+        Attach unlinked history rows that describe the same appointment. Rows
+        that drifted from their booking fall back to the old implicit link:
+        the unlinked history row with the booking's primary key.
+        """
+        pks = [booking.pk for booking in bookings]
+        already_linked = set(
+            ServiceHistory.objects.filter(booking__in=pks).values_list('booking', flat=True))
+        pending = [booking for booking in bookings if booking.pk not in already_linked]
+        if not pending:
+            return 0
+
+        dates = [booking.date for booking in pending]
+        candidates = {}
+        rows = ServiceHistory.objects.filter(
+            booking__isnull=True,
+            doctor__in={booking.doctor_id for booking in pending},
+            date__range=(min(dates), max(dates)),
+        ).order_by('pk')
+        for row in rows:
+            key = (row.patient_id, row.doctor_id, row.service_id, row.date, row.start_time)
+            candidates.setdefault(key, row)
+
+        to_link, unmatched = [], []
+        for booking in pending:
+            key = (
+                booking.patient_id, booking.doctor_id, booking.service_id,
+                booking.date, booking.start_time
+            )
+            row = candidates.pop(key, None)
+            if row is not None:
+                row.booking_id = booking.pk
+                to_link.append(row)
+            else:
+                unmatched.append(booking.pk)
+
+        if unmatched:
+            used = {row.pk for row in to_link}
+            same_pk = ServiceHistory.objects.filter(booking__isnull=True, pk__in=unmatched)
+            for row in same_pk:
+                if row.pk not in used:
+                    row.booking_id = row.pk
+                    to_link.append(row)
+        ServiceHistory.objects.bulk_update(to_link, ['booking'])
+        return len(to_link)
@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from applications.services.imports import import_patients
+
+
+class Command(BaseCommand):
+    help = 'Import patients from a CSV file (name, last_name, phone_number[, email]), skipping known phones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file, '-' for stdin")
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            if path == '-':
+                result = import_patients(sys.stdin, options['batch_size'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as lines:
+                    result = import_patients(lines, options['batch_size'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['rows']} rows in {result['seconds']}s ({result['rows_per_second']} rows/s): "
+            f"{result['created']} created, {result['duplicates']} duplicates, {result['invalid']} invalid"
+        ))
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from applications.services.models import ServiceHistory
+from applications.services.stats import rebuild_service_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute DailyServiceStats from ServiceHistory, one transaction per chunk of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='YYYY-MM-DD, first history date by default')
+        parser.add_argument('--to', dest='date_to', help='YYYY-MM-DD, last history date by default')
+        parser.add_argument('--days', type=int, default=31, help='days per transaction')
+
+    def handle(self, *args, **options):
+        bounds = ServiceHistory.objects.aggregate(first=Min('date'), last=Max('date'))
+        try:
+            date_from = self.parse(options['date_from']) or bounds['first']
+            date_to = self.parse(options['date_to']) or bounds['last']
+        except ValueError:
+            raise CommandError('Invalid date format, expected YYYY-MM-DD')
+        if date_from is None or date_to is None:
+            self.stdout.write('No service history')
+            return
+
+        step = timedelta(days=max(options['days'], 1))
+        rows = 0
+        while date_from <= date_to:
+            chunk_end = min(date_from + step - timedelta(days=1), date_to)
+            rows += rebuild_service_stats(date_from, chunk_end)
+            self.stdout.write(f'{date_from} - {chunk_end}: {rows} rows')
+            date_from = chunk_end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f'Done: {rows} rollup rows'))
+
+    def parse(self, value):
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
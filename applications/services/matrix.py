@@ -0,0 +1,154 @@
+import base64
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .availability import _minutes, free_intervals, load_intervals
+from .caching import _bump_version, _version
+from .models import Doctor
+
+
+# Матрица доступности всех врачей услуги на одну неделю.
+# Строка врача - битовая карта: бит (day * slots_per_day + slot) установлен,
+# если слот полностью свободен. Хранится little-endian в base64.
+# Строка не зависит от услуги, поэтому кэшируется по (врач, неделя) отдельно:
+# запись к одному врачу не трогает строки других, а список врачей услуги
+# кэшируется своим ключом. В ключ строки входит поколение врача: смена рабочих
+# часов сбрасывает сразу все его недели, сколько бы их ни было в кэше.
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def generation_key(doctor_id):
+    return f'availability:doctor:{doctor_id}:generation'
+
+
+def row_key(doctor_id, monday, generation):
+    return f'availability:doctor:{doctor_id}:{generation}:{monday.isoformat()}'
+
+
+def doctors_key(service_id):
+    return f'availability:service:{service_id}:doctors'
+
+
+def _slots_per_day():
+    return 24 * 60 // settings.AVAILABILITY_SLOT_MINUTES
+
+
+def _encode_row(working, busy, doctor_id, monday):
+    slot = settings.AVAILABILITY_SLOT_MINUTES
+    per_day = _slots_per_day()
+    bits = 0
+    for offset in range(7):
+        day = monday + timedelta(days=offset)
+        free = free_intervals(working[doctor_id, day.weekday()], busy[doctor_id, day])
+        for start, end in free:
+            first = -(-_minutes(start) // slot)
+            last = _minutes(end) // slot
+            for index in range(first, last):
+                bits |= 1 << (offset * per_day + index)
+    size = (7 * per_day + 7) // 8
+    return base64.b64encode(bits.to_bytes(size, 'little')).decode()
+
+
+def doctor_generations(doctor_ids):
+    """ Current row generation of every doctor in one cache round-trip """
+    keys = {doctor_id: generation_key(doctor_id) for doctor_id in doctor_ids}
+    found = cache.get_many(list(keys.values()))
+    return {
+        doctor_id: found[key] if key in found else _version(key)
+        for doctor_id, key in keys.items()
+    }
+
+
+def _service_doctor_ids(service_id):
+    doctor_ids = cache.get(doctors_key(service_id))
+    if doctor_ids is None:
+        doctor_ids = list(
+            Doctor.services.through.objects.filter(
+                service_id=service_id).order_by('doctor_id').values_list('doctor_id', flat=True)
+        )
+        cache.set(doctors_key(service_id), doctor_ids, settings.AVAILABILITY_MATRIX_TIMEOUT)
+    return doctor_ids
+
+
+def get_matrices(service_id, mondays):
+    """
+    Matrices for several weeks in one cache round-trip for the rows,
+    missing rows are built with two queries for all of them
+    """
+    doctor_ids = _service_doctor_ids(service_id)
+    generations = doctor_generations(doctor_ids)
+    keys = {
+        (doctor_id, monday): row_key(doctor_id, monday, generations[doctor_id])
+        for monday in mondays for doctor_id in doctor_ids
+    }
+    cached = cache.get_many(list(keys.values()))
+    missing = [pair for pair, key in keys.items() if key not in cached]
+    if missing:
+        working, busy = load_intervals(
+            {doctor_id for doctor_id, _ in missing},
+            min(monday for _, monday in missing),
+            max(monday for _, monday in missing) + timedelta(days=6)
+        )
+        rows = {
+            keys[doctor_id, monday]: _encode_row(working, busy, doctor_id, monday)
+            for doctor_id, monday in missing
+        }
+        cache.set_many(rows, settings.AVAILABILITY_MATRIX_TIMEOUT)
+        cached.update(rows)
+    return [
+        {
+            'week': monday.isoformat(),
+            'slot_minutes': settings.AVAILABILITY_SLOT_MINUTES,
+            'doctors': {
+                str(doctor_id): cached[keys[doctor_id, monday]] for doctor_id in doctor_ids
+            },
+        }
+        for monday in mondays
+    ]
+
+
+def _service_ids(doctor_id):
+    return list(
+        Doctor.services.through.objects.filter(
+            doctor_id=doctor_id).values_list('service_id', flat=True)
+    )
+
+
+def drop_doctor_weeks(doctor_weeks):
+    """
+    Drop the cached rows of (doctor_id, day) pairs after the transaction commits,
+    the next read rebuilds them from committed bookings
+    """
+    weeks = {(doctor_id, week_start(day)) for doctor_id, day in doctor_weeks}
+
+    def drop():
+        generations = doctor_generations({doctor_id for doctor_id, _ in weeks})
+        cache.delete_many([
+            row_key(doctor_id, monday, generations[doctor_id]) for doctor_id, monday in weeks
+        ])
+
+    transaction.on_commit(drop)
+
+
+def drop_doctor_rows(doctor_id):
+    """
+    Drop every cached week of the doctor after commit, e.g. when working hours
+    change: a new generation makes all old row keys unreachable
+    """
+    transaction.on_commit(lambda: _bump_version(generation_key(doctor_id)))
+
+
+def drop_service_doctors(service_ids):
+    """ Drop the cached doctor lists of the services when doctors are added or removed """
+    keys = [doctors_key(service_id) for service_id in service_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def drop_doctor_services(doctor_id):
+    drop_service_doctors(_service_ids(doctor_id))
@@ -0,0 +1,64 @@
+from django.db import migrations, models
+
+
+# PostgreSQL: exclusion constraint по диапазону времени врача.
+# SQLite: триггеры с тем же именем, RAISE(ABORT) превращается в IntegrityError.
+INSTALL_SQL = {
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS btree_gist',
+        'ALTER TABLE services_booking ADD CONSTRAINT booking_no_overlap '
+        'EXCLUDE USING gist ('
+        'doctor_id WITH =, '
+        'tsrange(date + start_time, date + end_time) WITH &&)',
+    ],
+    'sqlite': [
+        'CREATE TRIGGER booking_no_overlap_insert '
+        'BEFORE INSERT ON services_booking '
+        'WHEN EXISTS (SELECT 1 FROM services_booking '
+        'WHERE doctor_id = NEW.doctor_id AND date = NEW.date '
+        'AND start_time < NEW.end_time AND end_time > NEW.start_time) '
+        "BEGIN SELECT RAISE(ABORT, 'booking_no_overlap'); END",
+        'CREATE TRIGGER booking_no_overlap_update '
+        'BEFORE UPDATE OF doctor_id, date, start_time, end_time ON services_booking '
+        'WHEN EXISTS (SELECT 1 FROM services_booking '
+        'WHERE doctor_id = NEW.doctor_id AND date = NEW.date '
+        'AND start_time < NEW.end_time AND end_time > NEW.start_time '
+        'AND id != NEW.id) '
+        "BEGIN SELECT RAISE(ABORT, 'booking_no_overlap'); END",
+    ],
+}
+
+REMOVE_SQL = {
+    'postgresql': [
+        'ALTER TABLE services_booking DROP CONSTRAINT IF EXISTS booking_no_overlap',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS booking_no_overlap_insert',
+        'DROP TRIGGER IF EXISTS booking_no_overlap_update',
+    ],
+}
+
+
+def install_overlap_guard(apps, schema_editor):
+    for statement in INSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def remove_overlap_guard(apps, schema_editor):
+    for statement in REMOVE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['doctor', 'date', 'start_time', 'end_time'], name='booking_doctor_slot_idx'),
+        ),
+        migrations.RunPython(install_overlap_guard, remove_overlap_guard),
+    ]
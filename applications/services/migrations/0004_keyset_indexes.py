@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_working_hours'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['date', 'start_time', 'id'], name='booking_date_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicehistory',
+            index=models.Index(fields=['date', 'start_time', 'id'], name='history_date_start_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:40
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+# На SQLite AddField с NOT NULL пересоздаёт таблицу services_booking,
+# триггеры из 0002 при этом пропадают. PostgreSQL не затронут.
+overlap_guard = import_module('applications.services.migrations.0002_booking_overlap_guard')
+
+
+def reinstall_overlap_guard(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    overlap_guard.remove_overlap_guard(apps, schema_editor)
+    overlap_guard.install_overlap_guard(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_service_history_booking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(reinstall_overlap_guard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0007_booking_reminders'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicehistory',
+            index=models.Index(fields=['patient', 'date', 'start_time', 'id'], name='history_patient_date_idx'),
+        ),
+    ]
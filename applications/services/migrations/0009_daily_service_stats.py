@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q, Sum
+
+
+def fill_stats(apps, schema_editor):
+    ServiceHistory = apps.get_model('services', 'ServiceHistory')
+    DailyServiceStats = apps.get_model('services', 'DailyServiceStats')
+    confirmed = Q(confirmed=True)
+    rows = ServiceHistory.objects.filter(doctor__isnull=False, service__isnull=False).values(
+        'date', 'doctor', 'service'
+    ).annotate(
+        total=Count('id'),
+        total_confirmed=Count('id', filter=confirmed),
+        total_revenue=Sum('service__price', filter=confirmed),
+    ).order_by()
+    DailyServiceStats.objects.bulk_create([
+        DailyServiceStats(
+            date=row['date'], doctor_id=row['doctor'], service_id=row['service'],
+            count=row['total'], confirmed_count=row['total_confirmed'],
+            revenue=row['total_revenue'] or 0,
+        )
+        for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0008_history_patient_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyServiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('confirmed_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='services.doctor')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='services.service')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyservicestats',
+            constraint=models.UniqueConstraint(fields=('date', 'doctor', 'service'), name='daily_service_stats_unique'),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
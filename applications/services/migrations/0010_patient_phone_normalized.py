@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:26
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_phone_normalized(apps, schema_editor):
+    # та же нормализация, что models.normalize_phone на момент миграции
+    Patient = apps.get_model('services', 'Patient')
+    last_pk = 0
+    while True:
+        patients = list(Patient.objects.filter(pk__gt=last_pk).order_by('pk')[:1000])
+        if not patients:
+            return
+        for patient in patients:
+            digits = re.sub(r'\D', '', patient.phone_number or '')
+            if digits.startswith('0'):
+                digits = settings.PHONE_COUNTRY_CODE + digits[1:]
+            patient.phone_normalized = digits
+        Patient.objects.bulk_update(patients, ['phone_normalized'])
+        last_pk = patients[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0009_daily_service_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='phone_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(fill_phone_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:28
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+SEARCH_TABLES = ('services_patient', 'services_doctor')
+SEARCH_COLUMNS = ('name', 'last_name', 'phone_normalized')
+
+
+def install_sql(vendor, table):
+    """
+    PostgreSQL: trigram GIN index over the concatenated columns (see search.py).
+    SQLite: external content FTS5 table with the trigram tokenizer, kept in
+    sync by triggers.
+    """
+    pk = 'user_id' if table == 'services_doctor' else 'id'
+    columns = ', '.join(SEARCH_COLUMNS)
+    new = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+    old = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+    search = f'{table}_search'
+    if vendor == 'postgresql':
+        return [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            f"CREATE INDEX IF NOT EXISTS {search}_trgm ON {table} USING gin "
+            f"((name || ' ' || last_name || ' ' || phone_normalized) gin_trgm_ops)",
+        ]
+    if vendor == 'sqlite':
+        return [
+            f"CREATE VIRTUAL TABLE {search} USING fts5({columns}, "
+            f"content='{table}', content_rowid='{pk}', tokenize='trigram')",
+            f'CREATE TRIGGER {search}_insert AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {search}(rowid, {columns}) VALUES (new.{pk}, {new}); END',
+            f'CREATE TRIGGER {search}_delete AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {search}({search}, rowid, {columns}) VALUES ('delete', old.{pk}, {old}); END",
+            f'CREATE TRIGGER {search}_update AFTER UPDATE ON {table} BEGIN '
+            f"INSERT INTO {search}({search}, rowid, {columns}) VALUES ('delete', old.{pk}, {old}); "
+            f'INSERT INTO {search}(rowid, {columns}) VALUES (new.{pk}, {new}); END',
+            f"INSERT INTO {search}({search}) VALUES ('rebuild')",
+        ]
+    return []
+
+
+def remove_sql(vendor, table):
+    search = f'{table}_search'
+    if vendor == 'postgresql':
+        return [f'DROP INDEX IF EXISTS {search}_trgm']
+    if vendor == 'sqlite':
+        return [
+            f'DROP TRIGGER IF EXISTS {search}_{event}' for event in ('insert', 'delete', 'update')
+        ] + [f'DROP TABLE IF EXISTS {search}']
+    return []
+
+
+def fill_doctor_phones(apps, schema_editor):
+    Doctor = apps.get_model('services', 'Doctor')
+    doctors = list(Doctor.objects.all())
+    for doctor in doctors:
+        digits = re.sub(r'\D', '', doctor.phone_number or '')
+        if digits.startswith('0'):
+            digits = settings.PHONE_COUNTRY_CODE + digits[1:]
+        doctor.phone_normalized = digits
+    Doctor.objects.bulk_update(doctors, ['phone_normalized'], batch_size=1000)
+
+
+def install_search(apps, schema_editor):
+    for table in SEARCH_TABLES:
+        for statement in install_sql(schema_editor.connection.vendor, table):
+            schema_editor.execute(statement)
+
+
+def remove_search(apps, schema_editor):
+    for table in SEARCH_TABLES:
+        for statement in remove_sql(schema_editor.connection.vendor, table):
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0010_patient_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='phone_normalized',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(fill_doctor_phones, migrations.RunPython.noop),
+        migrations.RunPython(install_search, remove_search),
+    ]
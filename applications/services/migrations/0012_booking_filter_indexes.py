@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:30
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# AlterField пересоздаёт services_booking на SQLite - триггеры пересечений ставим заново
+reinstall_overlap_guard = import_module(
+    'applications.services.migrations.0006_booking_updated_at'
+).reinstall_overlap_guard
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0011_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='services.doctor'),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='services.patient'),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='service',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='services.service'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['patient', 'date', 'start_time', 'id'], name='booking_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['service', 'date', 'start_time', 'id'], name='booking_service_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('confirmed', False)), fields=['date', 'start_time', 'id'], name='booking_unconfirmed_date_idx'),
+        ),
+        migrations.RunPython(reinstall_overlap_guard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:40
+
+from django.db import migrations, transaction
+
+
+def _slot(row):
+    return (row.patient_id, row.doctor_id, row.service_id, row.date, row.start_time)
+
+
+def link_service_history(apps, schema_editor):
+    # та же связка, что backfill_service_history.link_chunk на момент миграции.
+    # Без неё первое сохранение записи после 0005 вставляет вторую строку истории,
+    # а старая несвязанная остаётся сиротой.
+    Booking = apps.get_model('services', 'Booking')
+    ServiceHistory = apps.get_model('services', 'ServiceHistory')
+    last_pk = 0
+    while True:
+        bookings = list(
+            Booking.objects.filter(pk__gt=last_pk, history__isnull=True).order_by('pk')[:1000]
+        )
+        if not bookings:
+            return
+        dates = [booking.date for booking in bookings]
+        with transaction.atomic():
+            candidates = {}
+            rows = ServiceHistory.objects.filter(
+                booking__isnull=True,
+                doctor__in={booking.doctor_id for booking in bookings},
+                date__range=(min(dates), max(dates)),
+            ).order_by('pk')
+            for row in rows:
+                candidates.setdefault(_slot(row), row)
+
+            to_link, unmatched = [], []
+            for booking in bookings:
+                row = candidates.pop(_slot(booking), None)
+                if row is not None:
+                    row.booking_id = booking.pk
+                    to_link.append(row)
+                else:
+                    unmatched.append(booking.pk)
+            # разошедшиеся строки - по старой неявной связи через pk
+            used = {row.pk for row in to_link}
+            for row in ServiceHistory.objects.filter(booking__isnull=True, pk__in=unmatched):
+                if row.pk not in used:
+                    row.booking_id = row.pk
+                    to_link.append(row)
+            ServiceHistory.objects.bulk_update(to_link, ['booking'])
+        last_pk = bookings[-1].pk
+
+
+class Migration(migrations.Migration):
+    # партии по 1000 записей коммитятся по отдельности
+    atomic = False
+
+    dependencies = [
+        ('services', '0012_booking_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_service_history, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,33 @@
-from django.db import models
+import re
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth import get_user_model
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 
+from .conflicts import OVERLAP_MESSAGE, is_overlap_error
+
 
 User = get_user_model()
 phone_regex = RegexValidator(regex=r'^(\+\d{1,3}|0)\d{10,15}$', 
                             message="Phone number must be entered in the format:" +
                             " '+999999999' or '0999999999'. Up to 15 digits allowed.")
 
+
+def normalize_phone(phone: str) -> str:
+    """ Digits with the country code: '+996 555 123-456' and '0555123456' give '996555123456' """
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('0'):
+        digits = settings.PHONE_COUNTRY_CODE + digits[1:]
+    return digits
+
+
 class Service(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    
+    duration = models.PositiveSmallIntegerField(default=30)  # в минутах
+
     def __str__(self) -> str:
         return self.name
 
@@ -28,60 +43,171 @@ class Doctor(models.Model):
     # image = models.ImageField(upload_to='images/avatars/', blank=True, null=True)
     schedule = models.TextField(blank=True, default='blank')
     services = models.ManyToManyField('Service')
+    # для поиска по телефону (search.py), заполняется в save()
+    phone_normalized = models.CharField(max_length=20, editable=False, default='')
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone_number)
+        super().save(*args, **kwargs)
 
     def __str__(self) -> str:
         return self.name
 
 
+class Weekday(models.IntegerChoices):
+    monday = 0
+    tuesday = 1
+    wednesday = 2
+    thursday = 3
+    friday = 4
+    saturday = 5
+    sunday = 6
+
+
+class WorkingHours(models.Model):
+    """ One working interval of a doctor on a weekday, several per day are allowed """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='working_hours')
+    weekday = models.PositiveSmallIntegerField(choices=Weekday.choices)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    def clean(self):
+        if self.start_time >= self.end_time:
+            raise ValidationError('Время начала должно быть раньше времени окончания.')
+
+    def __str__(self) -> str:
+        return f'{self.get_weekday_display()}: {self.start_time} - {self.end_time}'
+
+    class Meta:
+        ordering = ['weekday', 'start_time']
+        indexes = [
+            models.Index(fields=['doctor', 'weekday'], name='working_hours_doctor_idx'),
+        ]
+
+
 class Patient(models.Model):
     name = models.CharField(max_length=30)
     last_name = models.CharField(max_length=30)
     phone_number = models.CharField(validators=[phone_regex], max_length=15)
+    email = models.EmailField(blank=True)
+    # для поиска дублей при импорте, заполняется в save()
+    phone_normalized = models.CharField(max_length=20, db_index=True, editable=False, default='')
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone_number)
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         return self.name
 
 
 class Booking(models.Model):
-    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
-    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
-    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    # отдельные индексы FK не нужны: их покрывают составные индексы ниже
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, db_index=False)
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, db_index=False)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, db_index=False)
     date = models.DateField()
     confirmed = models.BooleanField(default=False)
     start_time = models.TimeField()
     end_time = models.TimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    # когда напоминание обработано (reminders.py), сбрасывается при переносе записи
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
 
     def clean(self):
-        conflicting_bookings = Booking.objects.filter(
-            doctor=self.doctor,
-            date=self.date,
-            start_time__lt=self.end_time,
-            end_time__gt=self.start_time,
-        ).exclude(pk=self.pk) if self.pk else Booking.objects.filter(
-            doctor=self.doctor,
-            date=self.date,
-            start_time__lt=self.end_time,
-            end_time__gt=self.start_time,
-        )
-
-        if conflicting_bookings.exists():
-            raise ValidationError('Для этого времени уже есть запись.')
-
+        # Пересечения проверяет база: exclusion constraint / триггеры из миграции 0002
         if self.start_time >= self.end_time:
             raise ValidationError('Время начала должно быть раньше времени окончания.')
 
+    # Поля, изменения которых отслеживают сигналы (см. signals.py)
+    TRACKED_FIELDS = (
+        'patient_id', 'doctor_id', 'service_id',
+        'date', 'confirmed', 'start_time', 'end_time'
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._original = {
+            field: instance.__dict__[field]
+            for field in cls.TRACKED_FIELDS if field in instance.__dict__
+        }
+        return instance
+
+    def load_original(self):
+        """ Snapshot for an instance that was not loaded from the db, one query """
+        if self.pk is None or hasattr(self, '_original'):
+            return
+        self._original = Booking.objects.filter(pk=self.pk).values(
+            *self.TRACKED_FIELDS).first() or {}
+
+    @property
+    def original(self) -> dict:
+        """ Tracked field values as they were loaded, empty for a new booking """
+        return getattr(self, '_original', {})
+
+    def changed_fields(self) -> set:
+        if not self.original:
+            return set(self.TRACKED_FIELDS)
+        return {
+            field for field, value in self.original.items()
+            if getattr(self, field) != value
+        }
+
     def save(self, *args, **kwargs):
-        self.full_clean()  
-        super().save(*args, **kwargs)
-    
+        # FK не проверяем запросами - их существование гарантирует сама база
+        self.clean_fields(exclude=['patient', 'doctor', 'service'])
+        self.clean()
+        self.load_original()
+        if self.original and self.changed_fields() & {'date', 'start_time'}:
+            self.reminder_sent_at = None
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as error:
+            if is_overlap_error(error):
+                raise ValidationError(OVERLAP_MESSAGE)
+            raise
+        self._original = {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+
     def __str__(self) -> str:
         return f'{self.start_time} - {self.end_time}/ {self.date}'
 
     class Meta:
         ordering = ['date']
+        indexes = [
+            models.Index(
+                fields=['doctor', 'date', 'start_time', 'end_time'],
+                name='booking_doctor_slot_idx'
+            ),
+            models.Index(
+                fields=['date', 'start_time', 'id'],
+                name='booking_date_start_idx'
+            ),
+            # фильтры BookingViewSet: поле + диапазон дат в порядке курсора
+            models.Index(
+                fields=['patient', 'date', 'start_time', 'id'], name='booking_patient_date_idx'
+            ),
+            models.Index(
+                fields=['service', 'date', 'start_time', 'id'], name='booking_service_date_idx'
+            ),
+            # неподтверждённых мало - частичный индекс, confirmed=true обслуживает booking_date_start_idx
+            models.Index(
+                fields=['date', 'start_time', 'id'], name='booking_unconfirmed_date_idx',
+                condition=models.Q(confirmed=False)
+            ),
+            models.Index(
+                fields=['date', 'start_time'], name='booking_reminder_due_idx',
+                condition=models.Q(reminder_sent_at__isnull=True)
+            ),
+        ]
 
 
 
 class ServiceHistory(models.Model):
+    booking = models.OneToOneField(
+        Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name='history'
+    )
     patient = models.ForeignKey(Patient, on_delete=models.SET_DEFAULT, default=None, null=True)
     doctor = models.ForeignKey(Doctor, on_delete=models.SET_DEFAULT, default=None, null=True)
     service = models.ForeignKey(Service, on_delete=models.SET_DEFAULT, default=None, null=True)
@@ -89,3 +215,36 @@ class ServiceHistory(models.Model):
     confirmed = models.BooleanField()
     start_time = models.TimeField()
     end_time = models.TimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['date', 'start_time', 'id'],
+                name='history_date_start_idx'
+            ),
+            models.Index(
+                fields=['patient', 'date', 'start_time', 'id'],
+                name='history_patient_date_idx'
+            ),
+        ]
+
+
+class DailyServiceStats(models.Model):
+    """
+    Rollup of ServiceHistory per day, doctor and service, kept up to date by
+    stats.py. Revenue is the price of confirmed services at the time they were
+    recorded; `rebuild_service_stats` recomputes everything with current prices.
+    """
+    date = models.DateField()
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='+')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+    confirmed_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'doctor', 'service'], name='daily_service_stats_unique'
+            ),
+        ]
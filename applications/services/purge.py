@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .history import upsert_service_history
+from .models import Booking
+
+
+PROGRESS_KEY = 'services:purge:last_pk'
+
+_expiring = ContextVar('expiring_bookings', default=False)
+
+
+def is_expiring() -> bool:
+    """ True while bookings are deleted because they expired, not canceled """
+    return _expiring.get()
+
+
+@contextmanager
+def expiring():
+    token = _expiring.set(True)
+    try:
+        yield
+    finally:
+        _expiring.reset(token)
+
+
+def purge_expired_bookings(batch_size=None, time_budget=None, resume=False):
+    """
+    Delete bookings older than yesterday in primary key batches, archiving their
+    final state to ServiceHistory first. Stops after time_budget seconds; the last
+    processed pk is kept in the cache, so a continuation with resume=True picks up
+    from it. A fresh run starts from the lowest pk: bookings below the checkpoint
+    may have expired since the previous pass.
+    Returns (deleted, finished).
+    """
+    batch_size = batch_size or settings.BOOKING_PURGE_BATCH_SIZE
+    time_budget = time_budget or settings.BOOKING_PURGE_TIME_BUDGET
+    cutoff = timezone.localdate() - timedelta(days=1)
+    deadline = time.monotonic() + time_budget
+    last_pk = cache.get(PROGRESS_KEY, 0) if resume else 0
+    deleted = 0
+
+    with expiring():
+        while time.monotonic() < deadline:
+            pks = list(
+                Booking.objects.filter(pk__gt=last_pk, date__lt=cutoff)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                cache.delete(PROGRESS_KEY)
+                return deleted, True
+            with transaction.atomic():
+                upsert_service_history(Booking.objects.filter(pk__in=pks))
+                deleted += Booking.objects.filter(pk__in=pks).delete()[1].get(Booking._meta.label, 0)
+            last_pk = pks[-1]
+            cache.set(PROGRESS_KEY, last_pk, None)
+    return deleted, False
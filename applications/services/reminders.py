@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from applications.account.utils import queue_emails
+from .models import Booking
+
+
+def due_bookings(now=None):
+    """
+    Bookings starting within BOOKING_REMINDER_LEAD_HOURS that were not reminded yet.
+    Served by the partial booking_reminder_due_idx: only unreminded rows are indexed.
+    """
+    now = timezone.localtime(now)
+    until = now + timedelta(hours=settings.BOOKING_REMINDER_LEAD_HOURS)
+    starts_after_now = Q(date__gt=now.date()) | Q(date=now.date(), start_time__gte=now.time())
+    starts_before_until = Q(date__lt=until.date()) | Q(date=until.date(), start_time__lte=until.time())
+    return Booking.objects.filter(
+        starts_after_now, starts_before_until,
+        date__range=(now.date(), until.date()), reminder_sent_at__isnull=True,
+    )
+
+
+def reminder_message(booking):
+    return (
+        f"{booking.patient.name} {booking.patient.last_name}, we remind you of your "
+        f"appointment '{booking.service.name}' with {booking.doctor.name} "
+        f"{booking.doctor.last_name} on {booking.date} at {booking.start_time}"
+    )
+
+
+def send_booking_reminders(batch_size=None):
+    """
+    Claim due bookings in chunks with SELECT ... FOR UPDATE SKIP LOCKED and queue
+    their emails in the same transaction that sets reminder_sent_at, so parallel
+    workers never pick the same booking and a reminder is queued at most once.
+    Bookings of patients without an email are marked as handled as well.
+    Returns the number of queued emails.
+    """
+    batch_size = batch_size or settings.BOOKING_REMINDER_BATCH_SIZE
+    queued = 0
+    while True:
+        with transaction.atomic():
+            bookings = list(
+                due_bookings()
+                .select_related('patient', 'doctor', 'service')
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('date', 'start_time')[:batch_size]
+            )
+            if not bookings:
+                return queued
+            emails = queue_emails([
+                ('Appointment reminder', reminder_message(booking), booking.patient.email)
+                for booking in bookings if booking.patient.email
+            ])
+            queued += len(emails)
+            # update() не вызывает сигналы - напоминание не меняет расписание,
+            # updated_at меняем сами: reminder_sent_at входит в ответ by_date (ETag)
+            now = timezone.now()
+            Booking.objects.filter(pk__in=[booking.pk for booking in bookings]).update(
+                reminder_sent_at=now, updated_at=now
+            )
+        if len(bookings) < batch_size:
+            return queued
@@ -0,0 +1,83 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+
+MIN_TERM_LENGTH = 3  # короче триграммы индекс не помогает
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def search_terms(query):
+    """
+    Words of the query of at least MIN_TERM_LENGTH characters. Phone-like parts
+    are reduced to digits, a leading 0 of a local number is dropped so that it
+    matches inside the normalized number with the country code.
+    """
+    terms = []
+    for word in (query or '').split():
+        if not any(char.isalpha() for char in word):
+            # часть номера: '0555 12' должно найти '99655512...'
+            word = re.sub(r'\D', '', word)
+            if word.startswith('0'):
+                word = word[1:]
+        if len(word) >= MIN_TERM_LENGTH:
+            terms.append(word)
+    return terms
+
+
+def _sqlite_ids(table, terms, limit):
+    # trigram FTS5: каждая фраза в кавычках ищется как подстрока, rank - bm25
+    match = ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    search = f'{table}_search'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {search} WHERE {search} MATCH %s ORDER BY rank LIMIT %s',
+            [match, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _postgresql_ids(table, pk, terms, limit):
+    # выражение совпадает с индексом {table}_search_trgm из миграции 0011
+    document = "(name || ' ' || last_name || ' ' || phone_normalized)"
+    conditions = ' AND '.join(f'{document} ILIKE %s' for _ in terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT {pk} FROM {table} WHERE {conditions} '
+            f'ORDER BY similarity({document}, %s) DESC, {pk} LIMIT %s',
+            [f'%{term}%' for term in terms] + [' '.join(terms), limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_ids(model, terms, limit):
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(name__icontains=term) | Q(last_name__icontains=term) | Q(phone_normalized__contains=term)
+        )
+    return list(model.objects.filter(condition).order_by('pk').values_list('pk', flat=True)[:limit])
+
+
+def search(queryset, query, limit=DEFAULT_LIMIT):
+    """
+    Patients or doctors matching every term of the query in name, last name or
+    phone, best matches first. Served by the vendor specific index from
+    migration 0011; returns None when the query has no searchable term.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+    limit = min(max(limit, 1), MAX_LIMIT)
+    model = queryset.model
+    table, pk = model._meta.db_table, model._meta.pk.column
+    if connection.vendor == 'sqlite':
+        ids = _sqlite_ids(table, terms, limit)
+    elif connection.vendor == 'postgresql':
+        ids = _postgresql_ids(table, pk, terms, limit)
+    else:
+        ids = _fallback_ids(model, terms, limit)
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
@@ -1,9 +1,12 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 
 from .models import (
     Service, Doctor, Patient,
     Booking, ServiceHistory
 )
+from .conflicts import OVERLAP_MESSAGE, find_conflicts
 
 class DoctorSerializer(serializers.ModelSerializer):
 
@@ -51,7 +54,10 @@ class PatientDetailSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def get_service_history(self, instance):
-        service_history = ServiceHistory.objects.filter(patient=instance.pk)
+        # последние записи одним запросом, остальные - /patient/<id>/history/
+        service_history = ServiceHistory.objects.filter(patient=instance.pk).select_related(
+            'service', 'doctor', 'patient'
+        ).order_by('-date', '-start_time', '-id')[:settings.PATIENT_RECENT_HISTORY_SIZE]
         serializer = ServiceHistoryListSerializer(instance=service_history, many=True)
         return serializer.data
 
@@ -73,28 +79,101 @@ class SwaggerBookingSerializer(serializers.Serializer):
     end_time = serializers.TimeField()
 
 
+class BulkBookingItemSerializer(SwaggerBookingSerializer):
+    confirmed = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['start_time'] >= attrs['end_time']:
+            raise serializers.ValidationError(
+                {'message': 'Время начала должно быть раньше времени окончания.'})
+        return attrs
+
+
+class BulkBookingSerializer(serializers.Serializer):
+    bookings = BulkBookingItemSerializer(many=True, allow_empty=False)
+
+    def validate_bookings(self, items):
+        if len(items) > settings.BOOKING_BULK_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Not more than {settings.BOOKING_BULK_MAX_SIZE} bookings at once')
+        related = {}
+        for name, model in (('patient', Patient), ('doctor', Doctor), ('service', Service)):
+            related[name] = model.objects.in_bulk({item[name] for item in items})
+            missing = {item[name] for item in items} - set(related[name])
+            if missing:
+                raise serializers.ValidationError(f'Unknown {name}: {sorted(missing)}')
+
+        bookings = [
+            Booking(
+                patient=related['patient'][item['patient']],
+                doctor=related['doctor'][item['doctor']],
+                service=related['service'][item['service']],
+                date=item['date'],
+                confirmed=item['confirmed'],
+                start_time=item['start_time'],
+                end_time=item['end_time']
+            )
+            for item in items
+        ]
+        conflicts = find_conflicts(bookings)
+        if conflicts:
+            raise serializers.ValidationError(
+                {'message': OVERLAP_MESSAGE, 'conflicts': conflicts})
+        return bookings
+
+
+class BulkConfirmSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False,
+        max_length=settings.BOOKING_BULK_MAX_SIZE)
+
+
 class BookingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Booking
         fields = '__all__'
+        # служебные поля ведут сама модель и планировщик напоминаний
+        read_only_fields = ('updated_at', 'reminder_sent_at')
+
+    def save(self, **kwargs):
+        # время и пересечения проверяет Booking.save - отвечаем 400, а не 500
+        try:
+            return super().save(**kwargs)
+        except DjangoValidationError as error:
+            raise serializers.ValidationError({'message': error.messages})
+
+
+class BookingDoctorSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Doctor
+        fields = ('user', 'name', 'last_name', 'phone_number', 'profession')
+
 
-    def get_fields(self):
-        fields = super().get_fields()
-        request = self.context.get('request', None)
-        if request and getattr(request, 'method', None) == 'GET':
-            fields['doctor'] = DoctorSerializer()
-            fields['service'] = ServiceSerializer()
-            fields['patient'] = PatientSerializer()
-        return fields
-
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        if self.context.get('request', None).method == 'GET':
-            representation['doctor'].pop('services')
-            representation['doctor'].pop('schedule')
-            representation['doctor'].pop('description')
-            representation['service'].pop('doctors')
-        return representation
+class BookingPatientSerializer(serializers.ModelSerializer):
+    # список бронирований доступен без авторизации - без email и служебных полей
+
+    class Meta:
+        model = Patient
+        fields = ('id', 'name', 'last_name', 'phone_number')
+
+
+class BookingServiceSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Service
+        fields = ('id', 'name', 'price', 'duration')
+
+
+class BookingReadSerializer(serializers.ModelSerializer):
+    """ GET representation, expects doctor, service and patient to be select_related """
+    doctor = BookingDoctorSerializer(read_only=True)
+    service = BookingServiceSerializer(read_only=True)
+    patient = BookingPatientSerializer(read_only=True)
+
+    class Meta:
+        model = Booking
+        fields = '__all__'
 
 
 class ServiceHistoryListSerializer(serializers.ModelSerializer):
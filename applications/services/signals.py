@@ -1,113 +1,212 @@
-from django.db.models.signals import post_save, pre_save, post_delete
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
+from django.db import transaction
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Booking, ServiceHistory
+from applications.notifications.utils import (
+    doctor_message, enqueue_messages, schedule_event
+)
+from .models import Booking, Doctor, Patient, Service, WorkingHours
+from .caching import bump_catalog_version, bump_patients_version
+from .history import upsert_service_history
+from .purge import is_expiring
+from .stats import STATS_FIELDS, record_booking_change
+from .serializers import DoctorScheduleSerializer
+from .matrix import (
+    drop_doctor_weeks, drop_doctor_rows, drop_service_doctors, drop_doctor_services
+)
+
+
+@receiver(pre_save, sender=Booking)
+def capture_booking_snapshot(sender, instance: Booking, **kwargs):
+    # Должен идти первым: остальные pre_save получатели используют instance.original
+    instance.load_original()
+    # текстовые сообщения врачу уходят в outbox одной вставкой вместе с
+    # событием расписания, см. publish_schedule_change
+    instance._doctor_messages = []
+
 
 @receiver(post_save, sender=Booking)
-def create_service_history(sender, instance: Booking, created, **kwargs):
-    # Creating service history
-    if created:
-        ServiceHistory.objects.create(
-            patient=instance.patient,
-            doctor=instance.doctor,
-            service=instance.service,
-            date=instance.date,
-            confirmed=instance.confirmed,
-            start_time = instance.start_time,
-            end_time = instance.end_time
-            )
+def sync_service_history(sender, instance: Booking, **kwargs):
+    # Creating or updating service history
+    if instance.changed_fields():
+        upsert_service_history([instance])
 
 
-@receiver(pre_save, sender=Booking)
-def update_service_history(sender, instance: Booking, **kwargs):
-    if instance.id is not None:  # Если объект обновлен
-        try:
-            old_instance = Booking.objects.get(id=instance.id)
-        except Booking.DoesNotExist:
-            old_instance = None
-
-        if old_instance != instance:
-            # Updating service history
-            try:
-                ServiceHistory.objects.filter(pk=instance.pk).update(
-                    patient=instance.patient,
-                    doctor=instance.doctor,
-                    service=instance.service,
-                    date=instance.date,
-                    confirmed=instance.confirmed,
-                    start_time = instance.start_time,
-                    end_time = instance.end_time
-                )
-            except Exception as e:
-                raise Exception('------------------------Booking was not found in history----------------------\nError message: ', e)
+@receiver(post_save, sender=Booking)
+def update_service_stats(sender, instance: Booking, created, **kwargs):
+    # Удаление записи не меняет статистику: история, как и раньше, сохраняется
+    if created or not instance.original:
+        record_booking_change(instance)
+    elif instance.changed_fields() & STATS_FIELDS:
+        record_booking_change(instance, instance.original)
 
 
 @receiver(post_save, sender=Booking)
 def notify_doctor(sender, instance: Booking, created, **kwargs):
     if created:
         doctor = instance.doctor
-        channel_layer = get_channel_layer()
         start_time = instance.start_time
         end_time = instance.end_time
         patient_info = instance.patient.name + ' ' + instance.patient.last_name
         doctor_name = doctor.name + ' ' + doctor.last_name
         service_name = instance.service.name
         service_price = instance.service.price
-        async_to_sync(channel_layer.group_send)(
-            f'{doctor.user.pk}',
-            {
-                "type": "new_booking",
-                "message": f"{doctor_name}, you have a new booking with service '{service_name}'\
-                from {start_time} to {end_time}, your patient is {patient_info}, price is {service_price}",
-            }
-        )
-    
+        instance._doctor_messages.append(doctor_message(
+            doctor.user_id,
+            f"{doctor_name}, you have a new booking with service '{service_name}'\
+            from {start_time} to {end_time}, your patient is {patient_info}, price is {service_price}"
+        ))
+
+
+RELATED_FIELDS = ('patient', 'service', 'doctor')
+
+
+def _original_related(instance: Booking):
+    """
+    Patient, service and doctor before the change. When some of them are not
+    loaded or were replaced, all three come from one select_related query, and
+    unchanged relations of the instance are filled from it too.
+    """
+    if all(
+        getattr(Booking, name).is_cached(instance)
+        and instance.original.get(f'{name}_id') == getattr(instance, f'{name}_id')
+        for name in RELATED_FIELDS
+    ):
+        return {name: getattr(instance, name) for name in RELATED_FIELDS}
+    stored = Booking.objects.select_related(*RELATED_FIELDS).get(pk=instance.pk)
+    related = {}
+    for name in RELATED_FIELDS:
+        related[name] = getattr(stored, name)
+        unchanged = related[name].pk == getattr(instance, f'{name}_id')
+        if unchanged and not getattr(Booking, name).is_cached(instance):
+            setattr(instance, name, related[name])
+    return related
+
+
 @receiver(pre_save, sender=Booking)
 def update_notify_doctor(sender, instance: Booking, **kwargs):
-    if instance.id is not None:
-        try:
-            old_instance = Booking.objects.get(id=instance.id)
-        except Booking.DoesNotExist:
-            old_instance = None
-    
+    if instance.original and instance.changed_fields():
+        original = instance.original
+        related = _original_related(instance)
+        old_patient = related['patient']
+        old_service = related['service']
+
         doctor = instance.doctor
-        channel_layer = get_channel_layer()
         start_time = instance.start_time
-        old_start_time = old_instance.start_time
+        old_start_time = original['start_time']
         end_time = instance.end_time
-        old_end_time = old_instance.end_time
-        old_patient_info = old_instance.patient.name + ' ' + old_instance.patient.last_name
-        old_service = old_instance.service.name
+        old_end_time = original['end_time']
+        old_patient_info = old_patient.name + ' ' + old_patient.last_name
+        old_service = old_service.name
         patient_info = instance.patient.name + ' ' + instance.patient.last_name
         doctor_name = doctor.name + ' ' + doctor.last_name
         service_name = instance.service.name
         service_price = instance.service.price
-        async_to_sync(channel_layer.group_send)(
-            f'{doctor.user.pk}',
-            {
-                "type": "new_booking",
-                "message": f"{doctor_name}, your old booking with service '{old_service}' \
-                from {old_start_time} to {old_end_time}, patient {old_patient_info} \
-                changed to booking with service '{service_name}'\
-                from {start_time} to {end_time}, your patient is {patient_info}, price is {service_price}",
-            }
-        )
-    
+        instance._doctor_messages.append(doctor_message(
+            doctor.user_id,
+            f"{doctor_name}, your old booking with service '{old_service}' \
+            from {old_start_time} to {old_end_time}, patient {old_patient_info} \
+            changed to booking with service '{service_name}'\
+            from {start_time} to {end_time}, your patient is {patient_info}, price is {service_price}"
+        ))
+
+
+def _slot(values):
+    return {
+        'date': values['date'].isoformat(),
+        'start_time': values['start_time'].isoformat(),
+        'end_time': values['end_time'].isoformat(),
+    }
+
+
 @receiver(post_delete, sender=Booking)
 def delete_notify_doctor(sender, instance: Booking, **kwargs):
+    if is_expiring():  # прошедшие записи удаляются без уведомлений
+        return
     doctor = instance.doctor
-    channel_layer = get_channel_layer()
     start_time = instance.start_time
     end_time = instance.end_time
     patient_info = instance.patient.name + ' ' + instance.patient.last_name
     doctor_name = doctor.name + ' ' + doctor.last_name
     service_name = instance.service.name
-    async_to_sync(channel_layer.group_send)(
-        f'{doctor.user.pk}',
-        {
-            "type": "new_booking",
-            "message": f"{doctor_name}, your booking with service '{service_name}'\
-            from {start_time} to {end_time}, patient is {patient_info} was canceled",
-        }
-    )
\ No newline at end of file
+    enqueue_messages([
+        doctor_message(
+            doctor.user_id,
+            f"{doctor_name}, your booking with service '{service_name}'\
+            from {start_time} to {end_time}, patient is {patient_info} was canceled"
+        ),
+        schedule_event(instance.doctor_id, 'removed', {'id': instance.pk, **_slot(instance.__dict__)}),
+    ])
+
+
+@receiver(post_save, sender=Booking)
+def publish_schedule_change(sender, instance: Booking, created, **kwargs):
+    if not instance.changed_fields():
+        return
+    booking = dict(DoctorScheduleSerializer(instance).data)
+    original = instance.original
+    if created:
+        messages = [schedule_event(instance.doctor_id, 'added', booking)]
+    elif original['doctor_id'] != instance.doctor_id:
+        messages = [
+            schedule_event(original['doctor_id'], 'removed', {'id': instance.pk, **_slot(original)}),
+            schedule_event(instance.doctor_id, 'added', booking),
+        ]
+    else:
+        messages = [schedule_event(instance.doctor_id, 'changed', booking, _slot(original))]
+    # после notify_doctor / update_notify_doctor: их текст уходит той же вставкой
+    enqueue_messages(instance.__dict__.pop('_doctor_messages', []) + messages)
+
+
+@receiver(post_save, sender=Booking)
+def drop_availability_on_save(sender, instance: Booking, created, **kwargs):
+    if not created and not instance.changed_fields() & {'doctor_id', 'date', 'start_time', 'end_time'}:
+        return
+    weeks = [(instance.doctor_id, instance.date)]
+    if not created:
+        # неделя, с которой запись перенесли
+        weeks.append((instance.original['doctor_id'], instance.original['date']))
+    drop_doctor_weeks(weeks)
+
+
+@receiver(post_delete, sender=Booking)
+def drop_availability_on_delete(sender, instance: Booking, **kwargs):
+    if is_expiring():
+        return
+    drop_doctor_weeks([(instance.doctor_id, instance.date)])
+
+
+@receiver(post_save, sender=WorkingHours)
+@receiver(post_delete, sender=WorkingHours)
+def drop_availability_on_working_hours(sender, instance: WorkingHours, **kwargs):
+    drop_doctor_rows(instance.doctor_id)
+
+
+@receiver(m2m_changed, sender=Doctor.services.through)
+def drop_availability_on_services(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        drop_service_doctors([instance.pk] if reverse else pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            drop_service_doctors([instance.pk])
+        else:
+            drop_doctor_services(instance.pk)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(m2m_changed, sender=Doctor.services.through)
+def invalidate_catalog_on_services(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_patients(sender, **kwargs):
+    transaction.on_commit(bump_patients_version)
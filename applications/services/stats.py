@@ -0,0 +1,114 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import DailyServiceStats, Service, ServiceHistory
+
+
+# Поля записи, от которых зависит её вклад в DailyServiceStats
+STATS_FIELDS = {'doctor_id', 'service_id', 'date', 'confirmed'}
+
+
+def _add(deltas, prices, state, sign):
+    """ Add (or subtract with sign=-1) one history state to the deltas """
+    counters = deltas[(state['date'], state['doctor_id'], state['service_id'])]
+    counters[0] += sign
+    if state['confirmed']:
+        counters[1] += sign
+        counters[2] += sign * prices[state['service_id']]
+
+
+def _prices(states):
+    service_ids = {state['service_id'] for state in states}
+    return dict(Service.objects.filter(pk__in=service_ids).values_list('pk', 'price'))
+
+
+def apply_stats_deltas(deltas):
+    """
+    Add {(date, doctor_id, service_id): [count, confirmed_count, revenue]} to the
+    rollups with one INSERT ... ON CONFLICT DO UPDATE per row, safe under concurrency
+    """
+    rows = [
+        (day, doctor_id, service_id, count, confirmed, str(revenue))
+        for (day, doctor_id, service_id), (count, confirmed, revenue) in deltas.items()
+        if count or confirmed or revenue
+    ]
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    table = quote(DailyServiceStats._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (date, doctor_id, service_id, {quote("count")}, '
+            f'confirmed_count, revenue) VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT (date, doctor_id, service_id) DO UPDATE SET '
+            f'{quote("count")} = {table}.{quote("count")} + EXCLUDED.{quote("count")}, '
+            f'confirmed_count = {table}.confirmed_count + EXCLUDED.confirmed_count, '
+            f'revenue = {table}.revenue + EXCLUDED.revenue',
+            rows
+        )
+
+
+def _state(booking):
+    return {field: getattr(booking, field) for field in STATS_FIELDS}
+
+
+def record_booking_change(booking, original=None):
+    """ Move the booking's contribution from its original state to the current one """
+    states = [_state(booking)] + ([original] if original else [])
+    prices = _prices(states)
+    deltas = defaultdict(lambda: [0, 0, Decimal(0)])
+    _add(deltas, prices, states[0], 1)
+    if original:
+        _add(deltas, prices, original, -1)
+    apply_stats_deltas(deltas)
+
+
+def record_bookings(bookings):
+    """ Count new bookings, e.g. after bulk_create which sends no signals """
+    deltas = defaultdict(lambda: [0, 0, Decimal(0)])
+    prices = {booking.service_id: booking.service.price for booking in bookings}
+    for booking in bookings:
+        _add(deltas, prices, _state(booking), 1)
+    apply_stats_deltas(deltas)
+
+
+def record_confirmations(bookings):
+    """ Bookings that changed from unconfirmed to confirmed with a bulk UPDATE """
+    deltas = defaultdict(lambda: [0, 0, Decimal(0)])
+    for booking in bookings:
+        counters = deltas[(booking.date, booking.doctor_id, booking.service_id)]
+        counters[1] += 1
+        counters[2] += booking.service.price
+    apply_stats_deltas(deltas)
+
+
+def aggregate_history(history):
+    """ DailyServiceStats rows computed from ServiceHistory with current prices """
+    confirmed = Q(confirmed=True)
+    rows = history.filter(doctor__isnull=False, service__isnull=False).values(
+        'date', 'doctor', 'service'
+    ).annotate(
+        total=Count('id'),
+        total_confirmed=Count('id', filter=confirmed),
+        total_revenue=Sum('service__price', filter=confirmed),
+    ).order_by()
+    return [
+        DailyServiceStats(
+            date=row['date'], doctor_id=row['doctor'], service_id=row['service'],
+            count=row['total'], confirmed_count=row['total_confirmed'],
+            revenue=row['total_revenue'] or 0,
+        )
+        for row in rows.iterator()
+    ]
+
+
+def rebuild_service_stats(date_from, date_to, batch_size=1000):
+    """ Recompute the rollups of a date range from ServiceHistory """
+    with transaction.atomic():
+        DailyServiceStats.objects.filter(date__range=(date_from, date_to)).delete()
+        stats = aggregate_history(ServiceHistory.objects.filter(date__range=(date_from, date_to)))
+        DailyServiceStats.objects.bulk_create(stats, batch_size=batch_size)
+    return len(stats)
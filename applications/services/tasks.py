@@ -1,9 +1,21 @@
 from celery import shared_task
-from datetime import timedelta
-from django.utils import timezone
-from .models import Booking
+from django.conf import settings
+from .purge import purge_expired_bookings
+from .reminders import send_booking_reminders
 
 @shared_task
-def delete_expired_bookings():
-    expired_bookings = Booking.objects.filter(date__lt=timezone.now() - timedelta(days=1))
-    expired_bookings.delete()
+def delete_expired_bookings(batch_size=None, time_budget=None, resume=False):
+    # запуск по расписанию начинает сначала, продолжение - с сохранённой позиции
+    deleted, finished = purge_expired_bookings(batch_size, time_budget, resume)
+    if not finished:
+        # бюджет времени исчерпан - продолжим с сохранённой позиции
+        delete_expired_bookings.apply_async(
+            kwargs={'batch_size': batch_size, 'time_budget': time_budget, 'resume': True},
+            countdown=settings.BOOKING_PURGE_PAUSE
+        )
+    return deleted
+
+
+@shared_task
+def send_due_reminders(batch_size=None):
+    return send_booking_reminders(batch_size)
@@ -1,3 +1,884 @@
-from django.test import TestCase
+import base64
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from applications.account.models import User
+from applications.account.models import OutgoingEmail
+from applications.notifications.models import OutboxMessage
+from .availability import free_intervals
+from .bulk import confirm_bookings
+from .conflicts import OVERLAP_MESSAGE, find_conflicts
+from .imports import import_patients
+from .matrix import doctor_generations, get_matrices, row_key
+from .models import (
+    Booking, DailyServiceStats, Doctor, Patient, Service, ServiceHistory, WorkingHours
+)
+from .reminders import send_booking_reminders
+from .tasks import delete_expired_bookings
+from .purge import PROGRESS_KEY, purge_expired_bookings
+from .pagination import BookingPagination, PatientHistoryPagination
+from .stats import rebuild_service_stats
+from .views import filter_bookings
+
+
+TEST_SETTINGS = {
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+}
+
+
+class BookingTestCase(APITestCase):
+
+    def setUp(self):
+        self.service = Service.objects.create(name='Consultation', price=1000)
+        self.patient = Patient.objects.create(
+            name='Patient', last_name='Test', phone_number='+996555000000')
+        self.doctors = []
+        for number in range(5):
+            user = User.objects.create(username=f'doctor{number}', email=f'doctor{number}@test.com')
+            doctor = Doctor.objects.create(
+                user=user, name='Doctor', last_name=f'{number}',
+                phone_number='+996555000001', profession='Therapist')
+            doctor.services.add(self.service)
+            self.doctors.append(doctor)
+
+    def create_bookings(self, count):
+        start = Booking.objects.count()
+        for number in range(start, start + count):
+            Booking.objects.create(
+                patient=self.patient, doctor=self.doctors[number % len(self.doctors)],
+                service=self.service, date=date(2030, 1, 1),
+                start_time=time(8 + number // len(self.doctors)),
+                end_time=time(9 + number // len(self.doctors)))
+
+
+@override_settings(**TEST_SETTINGS)
+class BookingQueryCountTest(BookingTestCase):
+
+    def test_list_query_count_is_constant(self):
+        self.create_bookings(1)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/booking/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.create_bookings(10)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/booking/')
+        self.assertEqual(len(response.data['results']), 11)
+
+    def test_cursor_walks_all_bookings(self):
+        self.create_bookings(11)
+        seen = []
+        url = '/api/v1/booking/?page_size=4'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            seen += [booking['id'] for booking in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(seen), 11)
+        self.assertEqual(len(set(seen)), 11)
+
+        response = self.client.get('/api/v1/booking/', {'paginate': 'false'})
+        self.assertEqual(len(response.data), 11)
+
+    def test_update_query_count(self):
+        self.create_bookings(1)
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        booking = Booking.objects.get()
+        outbox = OutboxMessage.objects.count()
+        # запись, savepoint, UPDATE, история, outbox одной вставкой
+        with self.assertNumQueries(6):
+            response = self.client.patch(
+                f'/api/v1/booking/{booking.pk}/', {'start_time': '10:00', 'end_time': '11:00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        payloads = [message.payload for message in OutboxMessage.objects.all()[outbox:]]
+        self.assertEqual([payload['type'] for payload in payloads], ['new_booking', 'schedule_change'])
+
+        # связи не загружены: прежние пациент, услуга и врач - одним запросом вместо трёх
+        booking = Booking.objects.get()
+        with self.assertNumQueries(6):
+            booking.start_time, booking.end_time = time(12), time(13)
+            booking.save()
+
+    def test_cursor_seeks_the_index(self):
+        position = [date(2030, 1, 1), time(8), 1]
+        plans = {
+            BookingPagination: (Booking.objects.all(), '(date>?)'),
+            PatientHistoryPagination: (ServiceHistory.objects.filter(patient=self.patient), '(patient_id=? AND date<?)'),
+        }
+        for pagination, (queryset, search) in plans.items():
+            plan = queryset.order_by(*pagination.ordering).filter(
+                pagination().after(position))[:pagination.page_size + 1].explain()
+            with self.subTest(pagination=pagination.__name__):
+                self.assertIn('SEARCH', plan)
+                self.assertIn(search, plan)
+
+    def test_by_date_query_count_is_constant(self):
+        self.create_bookings(10)
+        # fingerprint aggregate + the rows
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/booking/by_date/', {'date': '2030-01-01'})
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(
+            set(response.data[0]['doctor']),
+            {'user', 'name', 'last_name', 'phone_number', 'profession'})
+        self.assertNotIn('doctors', response.data[0]['service'])
+        self.assertEqual(set(response.data[0]['patient']), {'id', 'name', 'last_name', 'phone_number'})
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/v1/booking/by_date/', {'date': '2030-01-01'},
+                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(**TEST_SETTINGS)
+class BookingOverlapTest(APITestCase):
+
+    def setUp(self):
+        self.service = Service.objects.create(name='Consultation', price=1000)
+        self.patient = Patient.objects.create(name='Patient', last_name='Test', phone_number='+996555000000')
+        user = User.objects.create(username='doctor', email='doctor@test.com')
+        self.doctor = Doctor.objects.create(
+            user=user, name='Doctor', last_name='Test',
+            phone_number='+996555000001', profession='Therapist')
+
+    def book(self, start, end):
+        return Booking.objects.create(
+            patient=self.patient, doctor=self.doctor, service=self.service,
+            date=date(2030, 1, 1), start_time=start, end_time=end)
+
+    def test_overlapping_booking_is_rejected(self):
+        # 0006 пересоздаёт таблицу на SQLite - триггеры должны пережить миграции
+        self.book(time(8), time(9))
+        with self.assertRaisesMessage(ValidationError, OVERLAP_MESSAGE):
+            self.book(time(8, 30), time(9, 30))
+        # вплотную к существующей записи - не пересечение
+        self.book(time(9), time(10))
+
+    def test_overlap_through_api_is_bad_request(self):
+        self.book(time(8), time(9))
+        self.client.force_authenticate(User.objects.create(username='admin', email='admin@test.com', is_staff=True))
+        response = self.client.post('/api/v1/booking/', {
+            'patient': self.patient.pk, 'doctor': self.doctor.pk, 'service': self.service.pk,
+            'date': '2030-01-01', 'start_time': '08:30', 'end_time': '09:30',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], [OVERLAP_MESSAGE])
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+@override_settings(**TEST_SETTINGS)
+class BookingReminderTest(APITestCase):
+
+    def setUp(self):
+        service = Service.objects.create(name='Consultation', price=1000)
+        user = User.objects.create(username='doctor', email='doctor@test.com')
+        doctor = Doctor.objects.create(
+            user=user, name='Doctor', last_name='Test',
+            phone_number='+996555000001', profession='Therapist')
+        self.patient = Patient.objects.create(
+            name='Patient', last_name='Test', phone_number='+996555000000',
+            email='patient@test.com')
+        start = timezone.localtime() + timedelta(days=1)
+        self.bookings = [
+            Booking.objects.create(
+                patient=self.patient, doctor=doctor, service=service, date=start.date() + timedelta(days=offset),
+                start_time=time(10), end_time=time(11))
+            for offset in (-1, 5)
+        ]
+        self.now = timezone.make_aware(datetime.combine(start.date() - timedelta(days=1), time(9)))
+
+    def remind(self):
+        with mock.patch('applications.account.utils._schedule_sending'), \
+                mock.patch('django.utils.timezone.now', return_value=self.now):
+            return send_booking_reminders(batch_size=1)
+
+    def test_reminder_is_queued_once(self):
+        self.assertEqual(self.remind(), 1)
+        self.assertEqual(self.remind(), 0)
+        self.assertEqual(list(OutgoingEmail.objects.values_list('to', flat=True)), ['patient@test.com'])
+        soon, later = self.bookings
+        soon.refresh_from_db()
+        later.refresh_from_db()
+        self.assertIsNotNone(soon.reminder_sent_at)
+        self.assertIsNone(later.reminder_sent_at)
+
+    def test_rescheduled_booking_is_reminded_again(self):
+        self.remind()
+        soon = Booking.objects.get(pk=self.bookings[0].pk)
+        soon.start_time, soon.end_time = time(12), time(13)
+        soon.save()
+        self.assertIsNone(soon.reminder_sent_at)
+        self.assertEqual(self.remind(), 1)
+
+    def test_api_cannot_reset_bookkeeping_fields(self):
+        self.remind()
+        soon = Booking.objects.get(pk=self.bookings[0].pk)
+        self.client.force_authenticate(User.objects.create(username='admin', email='admin@test.com', is_staff=True))
+        response = self.client.patch(f'/api/v1/booking/{soon.pk}/', {
+            'confirmed': True, 'reminder_sent_at': None, 'updated_at': '2000-01-01T00:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        booking = Booking.objects.get(pk=soon.pk)
+        self.assertTrue(booking.confirmed)
+        self.assertEqual(booking.reminder_sent_at, soon.reminder_sent_at)
+        self.assertGreater(booking.updated_at, soon.updated_at)
+        self.assertEqual(self.remind(), 0)
+
+
+@override_settings(PATIENT_RECENT_HISTORY_SIZE=3, **TEST_SETTINGS)
+class PatientHistoryTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        self.create_bookings(7)
+
+    def test_detail_embeds_recent_history(self):
+        url = f'/api/v1/patient/{self.patient.pk}/'
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        history = response.data['service_history']
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history[0]['start_time'], '09:00:00')
+
+    def test_history_is_paginated_newest_first(self):
+        seen = []
+        url = f'/api/v1/patient/{self.patient.pk}/history/?page_size=3'
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            seen += [(item['start_time'], item['id']) for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+
+@override_settings(**TEST_SETTINGS)
+class ServiceStatsTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def rollups(self):
+        return sorted(
+            DailyServiceStats.objects.filter(count__gt=0)
+            .values_list('date', 'doctor', 'service', 'count', 'confirmed_count', 'revenue')
+        )
+
+    def test_rollups_follow_booking_changes(self):
+        self.create_bookings(6)
+        booking = Booking.objects.first()
+        booking.confirmed = True
+        booking.save()
+        moved = Booking.objects.last()
+        moved.date = date(2030, 1, 2)
+        moved.doctor = self.doctors[4]
+        moved.save()
+        confirm_bookings(list(Booking.objects.values_list('pk', flat=True)[:3]))
+
+        expected = self.rollups()
+        rebuild_service_stats(date(2030, 1, 1), date(2030, 1, 2))
+        self.assertEqual(expected, self.rollups())
+
+    def test_reports_read_rollups(self):
+        self.create_bookings(3)
+        confirm_bookings(list(Booking.objects.values_list('pk', flat=True)[:2]))
+        params = {'from': '2030-01-01', 'to': '2030-01-31'}
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/reports/services/', params)
+        self.assertEqual(response.data, [{
+            'service': self.service.pk, 'name': 'Consultation',
+            'count': 3, 'confirmed_count': 2, 'revenue': '2000.00',
+        }])
+        response = self.client.get('/api/v1/reports/doctors/', params)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['services'][0]['count'], 1)
+
+    def test_report_errors_do_not_echo_parameters(self):
+        for url, params in (
+            ('/api/v1/reports/services/', {'from': '2030-13-01'}),
+            ('/api/v1/reports/doctors/', {'to': 'tomorrow'}),
+            ('/api/v1/reports/doctors/', {'doctor': '<script>'}),
+        ):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data, {'error': 'Invalid parameters'})
+        response = self.client.get('/api/v1/reports/services/', {'from': '2030-02-01', 'to': '2030-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.data['error'].startswith('Range must be'))
+
+
+@override_settings(**TEST_SETTINGS)
+class ServiceHistoryExportTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        self.create_bookings(6)
+
+    def content(self, response):
+        # ответ асинхронный, иначе ASGI соберёт его в память целиком
+        self.assertTrue(response.is_async)
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(read)()
+
+    @override_settings(EXPORT_CHUNK_SIZE=3)
+    def test_csv_export(self):
+        response = self.client.get('/api/v1/serviceHistory/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = self.content(response).decode().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[0].startswith('id,date,start_time'))
+
+    def test_ndjson_export_is_filtered(self):
+        doctor = self.doctors[0]
+        response = self.client.get(
+            '/api/v1/serviceHistory/export/', {'output': 'ndjson', 'doctor': doctor.pk})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual({row['doctor_last_name'] for row in rows}, {doctor.last_name})
+        self.assertEqual(rows[0]['price'], '1000.00')
+
+    def test_export_is_admin_only(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/v1/serviceHistory/export/').status_code, 401)
+
+
+@override_settings(**TEST_SETTINGS)
+class PatientImportTest(APITestCase):
+
+    CSV = (
+        'name,last_name,phone_number,email\n'
+        'Ann,One,+996555000001,ann@test.com\n'
+        'Bob,Two,+996555000002,\n'
+        'Bob,Again,+996 (555) 000-002,\n'
+        'Known,Patient,+996 555 000 003,\n'
+        'Bad,Phone,12345,\n'
+    )
+
+    def setUp(self):
+        Patient.objects.create(name='Known', last_name='Patient', phone_number='+996555000003')
+
+    def test_import_dedupes_by_normalized_phone(self):
+        with self.assertNumQueries(2):
+            result = import_patients(io.StringIO(self.CSV), batch_size=10)
+        self.assertEqual(
+            (result['rows'], result['created'], result['duplicates'], result['invalid']), (5, 2, 2, 1))
+        self.assertEqual(result['errors'][0]['line'], 6)
+        self.assertEqual(
+            set(Patient.objects.values_list('phone_normalized', flat=True)),
+            {'996555000001', '996555000002', '996555000003'})
+
+    def test_admin_upload(self):
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        upload = SimpleUploadedFile('patients.csv', self.CSV.encode(), content_type='text/csv')
+        response = self.client.post('/api/v1/patient/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertIn('rows_per_second', response.data)
+
+    def test_values_longer_than_columns_are_reported(self):
+        rows = ''.join(
+            f'Long,Phone,+{"9" * (length - 1)},\n' for length in range(16, 20)
+        ) + f'Long,Email,+996555000009,{"a" * 250}@test.com\n'
+        result = import_patients(io.StringIO('name,last_name,phone_number,email\n' + rows), batch_size=10)
+        self.assertEqual((result['created'], result['invalid']), (0, 5))
+        self.assertEqual(
+            [error['error'] for error in result['errors'][:4]],
+            ['phone_number must be at most 15 characters'] * 4)
+        self.assertEqual(result['errors'][4], {'line': 6, 'error': 'email is too long'})
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name, last_name, phone in (
+            ('Aigul', 'Asanova', '+996700123456'),
+            ('Azamat', 'Asanov', '+996555987654'),
+            ('Bakyt', 'Ormonov', '+996555111222'),
+        ):
+            Patient.objects.create(name=name, last_name=last_name, phone_number=phone)
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def search_patients(self, query, **params):
+        response = self.client.get('/api/v1/patient/search/', {'q': query, **params})
+        return [patient['name'] for patient in response.data]
+
+    def test_patient_search_by_name_and_phone(self):
+        self.assertEqual(sorted(self.search_patients('asan')), ['Aigul', 'Azamat'])
+        self.assertEqual(self.search_patients('asanova'), ['Aigul'])
+        self.assertEqual(self.search_patients('0555 111'), ['Bakyt'])
+        self.assertEqual(self.search_patients('Azamat 987-654'), ['Azamat'])
+        self.assertEqual(len(self.search_patients('asan', limit=1)), 1)
+
+    def test_index_follows_changes(self):
+        patient = Patient.objects.get(name='Bakyt')
+        patient.last_name = 'Sadykov'
+        patient.save()
+        self.assertEqual(self.search_patients('ormonov'), [])
+        self.assertEqual(self.search_patients('sadyk'), ['Bakyt'])
+        patient.delete()
+        self.assertEqual(self.search_patients('sadyk'), [])
+
+    def test_short_query_is_rejected(self):
+        response = self.client.get('/api/v1/patient/search/', {'q': 'as'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_doctor_search_is_public(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/v1/doctor/search/', {'q': 'doctor'})
+        self.assertEqual(len(response.data), 5)
+        response = self.client.get('/api/v1/doctor/search/', {'q': '000001 Doctor'})
+        self.assertEqual(len(response.data), 5)
+
+
+@override_settings(**TEST_SETTINGS)
+class BookingFilterTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_bookings(10)
+
+    def test_filters(self):
+        doctor = self.doctors[1]
+        response = self.client.get('/api/v1/booking/', {'doctor': doctor.pk})
+        self.assertEqual({booking['doctor']['user'] for booking in response.data['results']}, {doctor.pk})
+        self.assertEqual(len(response.data['results']), 2)
+
+        response = self.client.get('/api/v1/booking/', {
+            'patient': self.patient.pk, 'confirmed': 'false',
+            'date_from': '2030-01-01', 'date_to': '2030-01-01',
+        })
+        self.assertEqual(len(response.data['results']), 10)
+        response = self.client.get('/api/v1/booking/', {'date_from': '2030-01-02'})
+        self.assertEqual(response.data['results'], [])
+
+        response = self.client.get('/api/v1/booking/', {'confirmed': 'maybe'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_plans_use_composite_indexes(self):
+        dates = {'date_from': '2030-01-01', 'date_to': '2030-01-31'}
+        plans = {
+            'booking_doctor_slot_idx': {'doctor': '1', **dates},
+            'booking_patient_date_idx': {'patient': '1', **dates},
+            'booking_service_date_idx': {'service': '1', **dates},
+            'booking_unconfirmed_date_idx': {'confirmed': 'false', **dates},
+            'booking_date_start_idx': dates,
+        }
+        for index, params in plans.items():
+            queryset = filter_bookings(Booking.objects.all(), params).order_by(
+                *BookingPagination.ordering)[:BookingPagination.page_size + 1]
+            with self.subTest(index=index):
+                self.assertIn(index, queryset.explain())
+
+
+class FreeIntervalsTest(SimpleTestCase):
+    working = [(time(9), time(12)), (time(13), time(17))]
+
+    def test_booking_spanning_two_working_intervals(self):
+        self.assertEqual(
+            free_intervals(self.working, [(time(11), time(14))]),
+            [(time(9), time(11)), (time(14), time(17))])
+
+    def test_back_to_back_bookings(self):
+        busy = [(time(9), time(10)), (time(10), time(11)), (time(13), time(14)), (time(14), time(17))]
+        self.assertEqual(free_intervals(self.working, busy), [(time(11), time(12))])
+
+    def test_bookings_outside_working_hours(self):
+        busy = [(time(7), time(8)), (time(12), time(13)), (time(18), time(19))]
+        self.assertEqual(free_intervals(self.working, busy), self.working)
+
+
+@override_settings(**TEST_SETTINGS)
+class AvailabilityMatrixTest(BookingTestCase):
+    monday = date(2029, 12, 31)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        patcher = mock.patch('applications.notifications.utils._schedule_dispatch')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for doctor in self.doctors:
+            WorkingHours.objects.create(doctor=doctor, weekday=1, start_time=time(8), end_time=time(12))
+
+    def is_free(self, doctor, hour):
+        # вторник 2030-01-01, слоты по 30 минут
+        row = get_matrices(self.service.pk, [self.monday])[0]['doctors'][str(doctor.pk)]
+        bits = int.from_bytes(base64.b64decode(row), 'little')
+        return bool(bits >> (48 + hour * 2) & 1)
+
+    def book(self, doctor, hour):
+        return Booking.objects.create(
+            patient=self.patient, doctor=doctor, service=self.service,
+            date=date(2030, 1, 1), start_time=time(hour), end_time=time(hour + 1))
+
+    def cached_row(self, doctor):
+        return cache.get(row_key(doctor.pk, self.monday, doctor_generations([doctor.pk])[doctor.pk]))
+
+    def test_booking_drops_only_its_doctor_row_on_commit(self):
+        first, second = self.doctors[:2]
+        self.assertTrue(self.is_free(first, 8))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.book(first, 8)
+            self.book(second, 9)
+        # до коммита кэш не тронут
+        self.assertTrue(self.is_free(first, 8))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.cached_row(self.doctors[2]))
+        self.assertIsNone(self.cached_row(first))
+        # две отсутствующие строки собираются двумя запросами
+        with self.assertNumQueries(2):
+            self.assertFalse(self.is_free(first, 8))
+        self.assertFalse(self.is_free(second, 9))
+        self.assertTrue(self.is_free(second, 8))
+
+    def test_rolled_back_booking_keeps_cache(self):
+        doctor = self.doctors[0]
+        self.assertTrue(self.is_free(doctor, 8))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.book(doctor, 8)
+                raise ValueError
+        self.assertEqual(callbacks, [])
+        self.assertTrue(self.cached_row(doctor))
+
+    def test_moved_booking_frees_original_week(self):
+        doctor = self.doctors[0]
+        booking = self.book(doctor, 8)
+        self.assertFalse(self.is_free(doctor, 8))
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.date = date(2030, 1, 8)
+            booking.save()
+        self.assertTrue(self.is_free(doctor, 8))
+
+    def test_working_hours_change_drops_distant_weeks(self):
+        # неделя 2029-12-31 далеко за пределами AVAILABILITY_MATRIX_WEEKS от сегодня
+        first, second = self.doctors[:2]
+        self.assertTrue(self.is_free(first, 8))
+        with self.captureOnCommitCallbacks(execute=True):
+            hours = WorkingHours.objects.get(doctor=first)
+            hours.start_time = time(10)
+            hours.save()
+        self.assertFalse(self.is_free(first, 8))
+        self.assertTrue(self.is_free(first, 10))
+        self.assertTrue(self.cached_row(second))
+
+    def test_new_service_doctor_appears_after_commit(self):
+        get_matrices(self.service.pk, [self.monday])
+        user = User.objects.create(username='doctor5', email='doctor5@test.com')
+        doctor = Doctor.objects.create(
+            user=user, name='Doctor', last_name='5', phone_number='+996555000001', profession='Therapist')
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.services.add(self.service)
+        self.assertIn(str(doctor.pk), get_matrices(self.service.pk, [self.monday])[0]['doctors'])
+
+
+@override_settings(**TEST_SETTINGS)
+class BulkBookingTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # doctor0 и doctor1 заняты 8:00-9:00
+        self.create_bookings(2)
+        admin = User.objects.create(username='admin', email='admin@test.com', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def item(self, doctor, start, end, **extra):
+        return {
+            'patient': self.patient.pk, 'doctor': doctor.pk, 'service': self.service.pk,
+            'date': '2030-01-01', 'start_time': start, 'end_time': end, **extra,
+        }
+
+    def booking(self, doctor, start, end):
+        return Booking(
+            patient=self.patient, doctor=doctor, service=self.service,
+            date=date(2030, 1, 1), start_time=start, end_time=end)
+
+    def test_find_conflicts(self):
+        first, second, third = self.doctors[:3]
+        bookings = [
+            self.booking(first, time(9), time(10)),  # вплотную к существующей
+            self.booking(second, time(8, 30), time(9, 30)),  # пересекается с существующей
+            self.booking(third, time(12), time(14)),
+            self.booking(third, time(13), time(13, 30)),  # внутри предыдущей из пакета
+            self.booking(third, time(14), time(15)),
+        ]
+        self.assertEqual(find_conflicts(bookings), [1, 2, 3])
+        self.assertEqual(find_conflicts([]), [])
+
+    def test_bulk_create_rejects_conflicts(self):
+        response = self.client.post('/api/v1/booking/bulk/', {'bookings': [
+            self.item(self.doctors[0], '10:00', '11:00'),
+            self.item(self.doctors[1], '08:30', '09:30'),
+            self.item(self.doctors[2], '12:00', '13:00'),
+            self.item(self.doctors[2], '12:30', '13:30'),
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([int(index) for index in response.data['bookings']['conflicts']], [1, 2, 3])
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_bulk_create_writes_history_and_notifications(self):
+        outbox = OutboxMessage.objects.count()
+        # 4 проверки, вставки записей, истории и outbox по одной, статистика - по строке на (дату, врача, услугу)
+        with self.assertNumQueries(10):
+            response = self.client.post('/api/v1/booking/bulk/', {'bookings': [
+                self.item(self.doctors[0], '10:00', '11:00'),
+                self.item(self.doctors[0], '11:00', '12:00', confirmed=True),
+                self.item(self.doctors[2], '08:00', '09:00'),
+            ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        ids = [booking['id'] for booking in response.data]
+        self.assertEqual(
+            set(ServiceHistory.objects.filter(booking__in=ids).values_list('booking', 'confirmed')),
+            {(ids[0], False), (ids[1], True), (ids[2], False)})
+        payloads = [message.payload for message in OutboxMessage.objects.all()[outbox:]]
+        # одно текстовое сообщение на врача и событие расписания на каждую запись
+        self.assertEqual(sorted(payload['type'] for payload in payloads), ['new_booking'] * 2 + ['schedule_change'] * 3)
+        self.assertEqual({payload['op'] for payload in payloads if payload['type'] == 'schedule_change'}, {'added'})
+
+    def test_bulk_confirm_skips_confirmed(self):
+        first, second = Booking.objects.order_by('id')
+        Booking.objects.filter(pk=second.pk).update(confirmed=True)
+        outbox = OutboxMessage.objects.count()
+        response = self.client.patch(
+            '/api/v1/booking/bulk-confirm/', {'ids': [first.pk, second.pk]}, format='json')
+        self.assertEqual(response.data, {'confirmed': [first.pk]})
+        self.assertTrue(ServiceHistory.objects.get(booking=first).confirmed)
+        self.assertEqual(OutboxMessage.objects.count() - outbox, 2)
+        response = self.client.patch('/api/v1/booking/bulk-confirm/', {'ids': [first.pk]}, format='json')
+        self.assertEqual(response.data, {'confirmed': []})
+
+    def test_repeated_confirm_is_counted_once(self):
+        first, second = Booking.objects.order_by('id')
+        outbox = OutboxMessage.objects.count()
+        for _ in range(2):
+            confirm_bookings([first.pk, second.pk, first.pk])
+        self.assertEqual(
+            DailyServiceStats.objects.get(date=date(2030, 1, 1), doctor=first.doctor).confirmed_count, 1)
+        self.assertEqual(
+            sum(DailyServiceStats.objects.values_list('confirmed_count', flat=True)), 2)
+        # текст и событие расписания на каждого из двух врачей - один раз
+        self.assertEqual(OutboxMessage.objects.count() - outbox, 4)
+
+
+@override_settings(**TEST_SETTINGS)
+class BackfillServiceHistoryTest(BookingTestCase):
+
+    def history(self, booking, **changes):
+        fields = {
+            'patient_id': booking.patient_id, 'doctor_id': booking.doctor_id,
+            'service_id': booking.service_id, 'date': booking.date, 'confirmed': booking.confirmed,
+            'start_time': booking.start_time, 'end_time': booking.end_time,
+        }
+        return ServiceHistory.objects.create(**{**fields, **changes})
+
+    def test_links_exact_and_drifted_rows(self):
+        self.create_bookings(3)
+        exact, drifted, missing = Booking.objects.order_by('pk')
+        ServiceHistory.objects.all().delete()
+        # строки до связи с Booking: старая связь держалась на совпадении pk
+        self.history(exact, id=exact.pk + 100)
+        self.history(drifted, id=drifted.pk, start_time=time(7), confirmed=True)
+
+        call_command('backfill_service_history', chunk_size=2, stdout=io.StringIO())
+
+        self.assertEqual(ServiceHistory.objects.count(), 3)
+        self.assertEqual(ServiceHistory.objects.get(booking=exact).pk, exact.pk + 100)
+        row = ServiceHistory.objects.get(booking=drifted)
+        self.assertEqual((row.pk, row.start_time, row.confirmed), (drifted.pk, drifted.start_time, False))
+        self.assertTrue(ServiceHistory.objects.filter(booking=missing).exists())
+        self.assertFalse(ServiceHistory.objects.filter(booking__isnull=True).exists())
+
+    def test_migration_links_rows_before_bookings_are_saved(self):
+        self.create_bookings(2)
+        exact, drifted = Booking.objects.order_by('pk')
+        ServiceHistory.objects.all().delete()
+        self.history(exact, id=exact.pk + 100)
+        self.history(drifted, id=drifted.pk, start_time=time(7))
+
+        import_module('applications.services.migrations.0013_link_service_history').link_service_history(apps, None)
+
+        # сохранение после миграции обновляет связанную строку, а не вставляет вторую
+        for booking in (exact, drifted):
+            booking.confirmed = True
+            booking.save()
+        self.assertEqual(
+            set(ServiceHistory.objects.values_list('pk', 'booking', 'start_time', 'confirmed')),
+            {(exact.pk + 100, exact.pk, exact.start_time, True), (drifted.pk, drifted.pk, drifted.start_time, True)})
+
+
+@override_settings(**TEST_SETTINGS)
+class PurgeExpiredBookingsTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.delete(PROGRESS_KEY)
+        self.create_bookings(1)
+        self.expired = [
+            Booking.objects.create(
+                patient=self.patient, doctor=doctor, service=self.service,
+                date=date(2020, 1, 1), start_time=time(8), end_time=time(9)).pk
+            for doctor in self.doctors
+        ]
+
+    def test_batches_archive_and_stay_silent(self):
+        outbox = OutboxMessage.objects.count()
+        self.assertEqual(purge_expired_bookings(batch_size=2, time_budget=60), (5, True))
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(ServiceHistory.objects.filter(date=date(2020, 1, 1), booking__isnull=True).count(), 5)
+        self.assertEqual(OutboxMessage.objects.count(), outbox)
+        self.assertIsNone(cache.get(PROGRESS_KEY))
+        # обычное удаление по-прежнему уведомляет врача
+        Booking.objects.get().delete()
+        self.assertGreater(OutboxMessage.objects.count(), outbox)
+
+    def test_time_budget_and_resume(self):
+        # дедлайн 10 с: первая партия укладывается, перед второй время вышло
+        with mock.patch('applications.services.purge.time.monotonic', side_effect=[0, 0, 100]):
+            self.assertEqual(purge_expired_bookings(batch_size=2, time_budget=10), (2, False))
+        self.assertEqual(cache.get(PROGRESS_KEY), self.expired[1])
+        self.assertFalse(Booking.objects.filter(pk__in=self.expired[:2]).exists())
+
+        # продолжение начинает с сохранённого pk, более ранние записи не перечитывает
+        cache.set(PROGRESS_KEY, self.expired[2], None)
+        self.assertEqual(purge_expired_bookings(batch_size=2, time_budget=60, resume=True), (2, True))
+        self.assertEqual(list(Booking.objects.filter(pk__in=self.expired).values_list('pk', flat=True)), [self.expired[2]])
+        self.assertIsNone(cache.get(PROGRESS_KEY))
+
+    def test_scheduled_run_ignores_stale_checkpoint(self):
+        # позиция осталась от прерванного прохода, записи ниже неё истекли позже
+        cache.set(PROGRESS_KEY, self.expired[-1], None)
+        with mock.patch('applications.services.tasks.delete_expired_bookings.apply_async') as apply_async:
+            self.assertEqual(delete_expired_bookings(batch_size=2, time_budget=60), 5)
+        apply_async.assert_not_called()
+        self.assertFalse(Booking.objects.filter(pk__in=self.expired).exists())
+
+    def test_unfinished_run_is_continued_from_checkpoint(self):
+        with mock.patch('applications.services.purge.time.monotonic', side_effect=[0, 0, 100]), \
+                mock.patch('applications.services.tasks.delete_expired_bookings.apply_async') as apply_async:
+            self.assertEqual(delete_expired_bookings(batch_size=2, time_budget=10), 2)
+        self.assertTrue(apply_async.call_args.kwargs['kwargs']['resume'])
+
+
+@override_settings(**TEST_SETTINGS)
+class CatalogCacheTest(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        patcher = mock.patch('applications.notifications.utils._schedule_dispatch')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_changed(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_matching_etag_is_answered_from_cache(self):
+        response = self.client.get('/api/v1/service/')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/service/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/service/').status_code, 200)
+
+    def test_service_and_doctor_saves_invalidate(self):
+        etag = self.client.get('/api/v1/service/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.name = 'Checkup'
+            self.service.save()
+        response = self.get_changed('/api/v1/service/', etag)
+        self.assertEqual(response.data[0]['name'], 'Checkup')
+
+        doctor = self.doctors[0]
+        doctor_etag = self.client.get(f'/api/v1/doctor/{doctor.pk}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.last_name = 'Surgeon'
+            doctor.save()
+        self.assertEqual(self.get_changed(f'/api/v1/doctor/{doctor.pk}/', doctor_etag).data['last_name'], 'Surgeon')
+        # услуга вкладывает имена врачей - её ответ тоже устарел
+        self.assertIn('Surgeon', self.get_changed('/api/v1/service/', response['ETag']).content.decode())
+
+    def test_doctor_services_change_invalidates(self):
+        service = Service.objects.create(name='Massage', price=500)
+        doctor = self.doctors[0]
+        etag = self.client.get(f'/api/v1/doctor/{doctor.pk}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.services.add(service)
+        response = self.get_changed(f'/api/v1/doctor/{doctor.pk}/', etag)
+        self.assertEqual(response.data['services'], [self.service.pk, service.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.services.clear()
+        self.assertEqual(self.get_changed(f'/api/v1/doctor/{doctor.pk}/', response['ETag']).data['services'], [])
+
+
+@override_settings(**TEST_SETTINGS)
+class BookingConditionalGetTest(BookingTestCase):
+    url = '/api/v1/booking/by_date/'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.create_bookings(2)
+        self.etag = self.client.get(self.url, {'date': '2030-01-01'})['ETag']
+
+    def assertStale(self):
+        response = self.client.get(self.url, {'date': '2030-01-01'}, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_unchanged_bookings_are_not_modified(self):
+        response = self.client.get(self.url, {'date': '2030-01-01'}, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_nested_patient_and_service_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.last_name = 'Renamed'
+            self.patient.save()
+        self.assertEqual(self.assertStale().data[0]['patient']['last_name'], 'Renamed')
+
+        self.etag = self.client.get(self.url, {'date': '2030-01-01'})['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.name = 'Checkup'
+            self.service.save()
+        self.assertEqual(self.assertStale().data[0]['service']['name'], 'Checkup')
+
+    def test_reminder_changes_etag(self):
+        Patient.objects.filter(pk=self.patient.pk).update(email='patient@test.com')
+        now = timezone.make_aware(datetime(2029, 12, 31, 9))
+        with mock.patch('applications.account.utils._schedule_sending'), \
+                mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertEqual(send_booking_reminders(), 2)
+        self.assertIsNotNone(self.assertStale().data[0]['reminder_sent_at'])
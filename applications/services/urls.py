@@ -5,7 +5,8 @@ from .views import (
     ServiceViewSet, DoctorViewSet, 
     BookingViewSet, PatientViewSet,
     ServiceHistoryListView, ServiceHistoryRetrieveView,
-    get_doctor_schedule
+    get_doctor_schedule, get_doctor_availability,
+    get_services_report, get_doctors_report, export_service_history
 )
 
 router = routers.DefaultRouter()
@@ -15,7 +16,11 @@ router.register('booking', BookingViewSet, 'bookings')
 router.register('patient', PatientViewSet, 'patients')
 urlpatterns = router.urls + [
     path('serviceHistory/', ServiceHistoryListView.as_view(), name='service-history-list'),
+    path('serviceHistory/export/', export_service_history, name='service-history-export'),
     path('serviceHistory/<int:pk>/', ServiceHistoryRetrieveView.as_view(), name='service-history-detail'),
     path('doctor/<int:doctor_id>/schedule/<str:date>/', get_doctor_schedule, name='doctor_schedule'),
+    path('doctor/<int:doctor_id>/availability/', get_doctor_availability, name='doctor_availability'),
+    path('reports/services/', get_services_report, name='services_report'),
+    path('reports/doctors/', get_doctors_report, name='doctors_report'),
 
 ]
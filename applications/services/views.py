@@ -1,9 +1,14 @@
-from datetime import datetime
-from django.http import JsonResponse
-from rest_framework.decorators import action, api_view
+import io
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models import Sum
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAdminUser, AllowAny, SAFE_METHODS
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
@@ -13,9 +18,21 @@ from permissions import NoOne
 
 from .models import (
     Service, Doctor, Patient,
-    Booking, ServiceHistory
+    Booking, ServiceHistory, DailyServiceStats
 )
 from .serializers import *
+from .bulk import create_bookings, confirm_bookings
+from .availability import MAX_RANGE_DAYS, get_availability
+from .matrix import get_matrices, week_start
+from .caching import (
+    CatalogCacheMixin, bookings_fingerprint, catalog_version, etag_matches, not_modified, patients_version
+)
+from .export import csv_lines, history_rows, ndjson_lines
+from .imports import import_patients
+from .search import DEFAULT_LIMIT, MAX_LIMIT, MIN_TERM_LENGTH, search
+from .pagination import (
+    BookingPagination, ServiceHistoryPagination, PatientPagination, PatientHistoryPagination
+)
 
 
 def get_default_permissions(func):
@@ -27,27 +44,92 @@ def get_default_permissions(func):
         return func(self)
     return wrapper
 
-class ServiceViewSet(ModelViewSet):
+SEARCH_PARAMETERS = [
+    openapi.Parameter(
+        'q',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        description=f'name, last name or phone, words shorter than {MIN_TERM_LENGTH} characters are ignored',
+        required=True
+    ),
+    openapi.Parameter(
+        'limit',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_INTEGER,
+        description=f'{DEFAULT_LIMIT} by default, at most {MAX_LIMIT}'
+    ),
+]
+
+
+def search_response(request, queryset, serializer_class):
+    """ Ranked ?q= search over the search index, see search.py """
+    try:
+        limit = int(request.query_params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return Response({'error': 'Invalid limit'}, status=400)
+    results = search(queryset, request.query_params.get('q'), limit)
+    if results is None:
+        return Response(
+            {'error': f'q must contain a word of at least {MIN_TERM_LENGTH} characters'}, status=400)
+    return Response(serializer_class(results, many=True).data)
+
+
+class ServiceViewSet(CatalogCacheMixin, ModelViewSet):
     """ POST/PUT/PATCH/DELETE works if user is admin """
-    queryset = Service.objects.all() 
+    queryset = Service.objects.prefetch_related('doctor_set__services')
     serializer_class = ServiceSerializer
     
     @get_default_permissions
     def get_permissions(self):
         return super().get_permissions()
-    
-    def retrieve(self, request, *args, **kwargs):
-        self.serializer_class = ServiceDetailSerializer
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
-    
-    
-    
-class DoctorViewSet(ModelViewSet):
-    queryset = Doctor.objects.all()
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return ServiceDetailSerializer
+        return super().get_serializer_class()
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'from',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description='date format: YYYY-MM-DD, current week by default'
+            ),
+            openapi.Parameter(
+                'weeks',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description='number of weeks, 2 by default'
+            )
+        ]
+    )
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """ Availability bitmaps of every doctor of the service, one per week """
+        try:
+            date_param = request.query_params.get('from')
+            date = datetime.strptime(date_param, '%Y-%m-%d').date() if date_param else datetime.today().date()
+            weeks = int(request.query_params.get('weeks', 2))
+        except ValueError:
+            return Response({'error': 'Invalid parameters'}, status=400)
+        if not 1 <= weeks <= settings.AVAILABILITY_MATRIX_WEEKS or not pk.isdigit():
+            return Response({'error': 'Invalid parameters'}, status=400)
+        monday = week_start(date)
+        mondays = [monday + timedelta(weeks=week) for week in range(weeks)]
+        return Response({'service': int(pk), 'weeks': get_matrices(int(pk), mondays)})
+
+
+class DoctorViewSet(CatalogCacheMixin, ModelViewSet):
+    queryset = Doctor.objects.prefetch_related('services')
     serializer_class = DoctorSerializer
 
+    @swagger_auto_schema(manual_parameters=SEARCH_PARAMETERS)
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """ Doctors by name, last name or phone, best matches first """
+        return search_response(request, self.get_queryset(), DoctorSerializer)
+
     def get_permissions(self):
         if self.request.method in SAFE_METHODS:
             self.permission_classes = [AllowAny]
@@ -61,6 +143,7 @@ class DoctorViewSet(ModelViewSet):
 class PatientViewSet(ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
+    pagination_class = PatientPagination
 
     def get_permissions(self):
         self.permission_classes = [IsAdminUser]
@@ -70,13 +153,124 @@ class PatientViewSet(ModelViewSet):
         self.serializer_class = PatientDetailSerializer
         return super().retrieve(request, *args, **kwargs)
 
+    @swagger_auto_schema(manual_parameters=SEARCH_PARAMETERS)
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """ Patients by name, last name or phone, best matches first """
+        return search_response(request, self.get_queryset(), PatientSerializer)
+
+    @swagger_auto_schema(responses={200: ServiceHistoryListSerializer(many=True)})
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """ Service history of the patient, newest first, cursor paginated """
+        patient = self.get_object()
+        queryset = ServiceHistory.objects.filter(patient=patient).select_related(
+            'service', 'doctor', 'patient'
+        )
+        paginator = PatientHistoryPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if page is None:
+            queryset = queryset.order_by(*paginator.ordering)
+            return Response(ServiceHistoryListSerializer(queryset, many=True).data)
+        return paginator.get_paginated_response(ServiceHistoryListSerializer(page, many=True).data)
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'file',
+                in_=openapi.IN_FORM,
+                type=openapi.TYPE_FILE,
+                description='CSV with columns name, last_name, phone_number and optional email',
+                required=True
+            )
+        ]
+    )
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_csv(self, request):
+        """ Same import as `manage.py import_patients`, patients with a known phone are skipped """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=400)
+        try:
+            result = import_patients(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''))
+        except (UnicodeDecodeError, ValueError) as error:
+            return Response({'error': str(error)}, status=400)
+        return Response(result, status=201 if result['created'] else 200)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_bool(value):
+    if value.lower() not in ('true', 'false'):
+        raise ValueError(value)
+    return value.lower() == 'true'
+
+
+# query параметр -> (lookup, разбор значения); каждое поле вместе с диапазоном дат
+# обслуживает свой составной индекс Booking (миграция 0012)
+BOOKING_FILTERS = {
+    'doctor': ('doctor', int),
+    'patient': ('patient', int),
+    'service': ('service', int),
+    'confirmed': ('confirmed', _parse_bool),
+    'date_from': ('date__gte', _parse_date),
+    'date_to': ('date__lte', _parse_date),
+}
+
+BOOKING_FILTER_PARAMETERS = [
+    openapi.Parameter('doctor', in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    openapi.Parameter('patient', in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    openapi.Parameter('service', in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    openapi.Parameter('confirmed', in_=openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+    openapi.Parameter(
+        'date_from', in_=openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE, description='date format: YYYY-MM-DD'
+    ),
+    openapi.Parameter(
+        'date_to', in_=openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE, description='date format: YYYY-MM-DD'
+    ),
+]
+
+
+def filter_bookings(queryset, params):
+    """ Apply BOOKING_FILTERS from query params, invalid values give a 400 """
+    conditions = {}
+    for param, (lookup, parse) in BOOKING_FILTERS.items():
+        value = params.get(param)
+        if value is None or value == '':
+            continue
+        try:
+            conditions[lookup] = parse(value)
+        except ValueError:
+            raise ValidationError({param: 'Invalid value'})
+    return queryset.filter(**conditions)
+
 
 class BookingViewSet(ModelViewSet):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
+    pagination_class = BookingPagination
     @get_default_permissions
     def get_permissions(self):
         return super().get_permissions() 
+
+    def get_queryset(self):
+        return filter_bookings(
+            Booking.objects.select_related('doctor', 'service', 'patient'),
+            self.request.query_params
+        )
+
+    def get_serializer_class(self):
+        if self.request.method in SAFE_METHODS:
+            return BookingReadSerializer
+        return BookingSerializer
+
+    @swagger_auto_schema(manual_parameters=BOOKING_FILTER_PARAMETERS)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     @swagger_auto_schema(request_body=SwaggerBookingSerializer)
     def create(self, request, *args, **kwargs):
@@ -90,6 +284,23 @@ class BookingViewSet(ModelViewSet):
     def partial_update(self, request, *args, **kwargs):
         return super().partial_update(request, *args, **kwargs)
     
+    @swagger_auto_schema(request_body=BulkBookingSerializer, responses={201: BookingSerializer(many=True)})
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """ Create a series of bookings in one request, conflicts are checked for the whole batch """
+        serializer = BulkBookingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        bookings = create_bookings(serializer.validated_data['bookings'])
+        return Response(BookingSerializer(bookings, many=True).data, status=201)
+
+    @swagger_auto_schema(request_body=BulkConfirmSerializer)
+    @action(detail=False, methods=['patch'], url_path='bulk-confirm')
+    def bulk_confirm(self, request):
+        serializer = BulkConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        bookings = confirm_bookings(serializer.validated_data['ids'])
+        return Response({'confirmed': [booking.pk for booking in bookings]})
+
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
@@ -105,23 +316,84 @@ class BookingViewSet(ModelViewSet):
     def by_date(self, request):
         date_param = request.query_params.get('date')  # Получение параметра даты из запроса
         try:
-            date = datetime.strptime(date_param, '%Y-%m-%d').date()  # Преобразование строки в объект даты
-            bookings = Booking.objects.filter(date=date)  # Запрос для получения всех бронирований на эту дату
+            date = _parse_date(date_param)  # Преобразование строки в объект даты
+            bookings = self.get_queryset().filter(date=date)  # Запрос для получения всех бронирований на эту дату
+            # в ответ вложены врач, услуга и пациент - их изменения тоже меняют ETag
+            etag, headers = bookings_fingerprint(bookings, [catalog_version(), patients_version()])
+            if etag_matches(request, etag):
+                return not_modified(etag)
             serializer = self.get_serializer(bookings, many=True)
-            return Response(serializer.data)
+            return Response(serializer.data, headers=headers)
         except (ValueError, TypeError):
             return Response({'error': 'Invalid date format'}, status=400)
 
 
 class ServiceHistoryListView(ListAPIView):
-    queryset = ServiceHistory.objects.all()
+    queryset = ServiceHistory.objects.select_related('service', 'doctor', 'patient')
     serializer_class = ServiceHistoryListSerializer 
+    pagination_class = ServiceHistoryPagination
 
     def get_permissions(self):
         self.permission_classes = [IsAdminUser]
         return super().get_permissions()
     
     
+EXPORT_OUTPUTS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter(
+            'output',
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            enum=list(EXPORT_OUTPUTS),
+            description='csv by default'
+        ),
+        openapi.Parameter(
+            'from',
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            format=openapi.FORMAT_DATE,
+            description='date format: YYYY-MM-DD'
+        ),
+        openapi.Parameter(
+            'to',
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            format=openapi.FORMAT_DATE,
+            description='date format: YYYY-MM-DD'
+        ),
+        openapi.Parameter('doctor', in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    ]
+)
+def export_service_history(request):
+    """ Whole service history as a stream, memory use does not depend on its size """
+    output = request.query_params.get('output', 'csv')
+    if output not in EXPORT_OUTPUTS:
+        return JsonResponse({'error': f'output must be one of: {", ".join(EXPORT_OUTPUTS)}'}, status=400)
+    try:
+        date_from, date_to = (
+            datetime.strptime(value, '%Y-%m-%d').date() if value else None
+            for value in (request.query_params.get('from'), request.query_params.get('to'))
+        )
+        doctor = request.query_params.get('doctor')
+        doctor = int(doctor) if doctor else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid parameters'}, status=400)
+
+    lines, content_type = EXPORT_OUTPUTS[output]
+    rows = history_rows(date_from, date_to, doctor, settings.EXPORT_CHUNK_SIZE)
+    response = StreamingHttpResponse(lines(rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="service_history.{output}"'
+    return response
+
+
 class ServiceHistoryRetrieveView(RetrieveAPIView):
     queryset = ServiceHistory.objects.all()
     serializer_class = ServiceHistoryRetrieveSerializer 
@@ -158,13 +430,174 @@ def get_doctor_schedule(request, doctor_id, date):
         doctor = Doctor.objects.get(pk=doctor_id)
         schedule_date = datetime.strptime(date, '%Y-%m-%d').date()
         bookings = Booking.objects.filter(doctor=doctor, date=schedule_date)
+        etag, headers = bookings_fingerprint(bookings)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         serialized_data = DoctorScheduleSerializer(bookings, many=True)  # Сериализация данных
 
-        return JsonResponse(serialized_data.data, safe=False)
+        return JsonResponse(serialized_data.data, safe=False, headers=headers)
     except Doctor.DoesNotExist:
         return JsonResponse({'error': 'Doctor does not exist'}, status=404)
     except ValueError:
         return JsonResponse({'error': 'Invalid date format'}, status=400)
-    
-    
-#TODO количество оказанных услуг, услуги через докторов - доктора через услуги,  написать тесты
\ No newline at end of file
+
+
+
+@api_view(['GET'])
+@swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter(
+            'doctor_id',
+            in_=openapi.IN_PATH,
+            type=openapi.TYPE_INTEGER,
+            description="doctor's ID",
+            required=True
+        ),
+        openapi.Parameter(
+            'from',
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            format=openapi.FORMAT_DATE,
+            description='date format: YYYY-MM-DD, today by default'
+        ),
+        openapi.Parameter(
+            'to',
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            format=openapi.FORMAT_DATE,
+            description='date format: YYYY-MM-DD, a week from "from" by default'
+        ),
+        openapi.Parameter(
+            'service',
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_INTEGER,
+            description="only intervals long enough for this service"
+        )
+    ]
+)
+def get_doctor_availability(request, doctor_id):
+    """ Free intervals of the doctor, computed from working hours and bookings """
+    try:
+        doctor = Doctor.objects.get(pk=doctor_id)
+        date_from = request.query_params.get('from')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else datetime.today().date()
+        date_to = request.query_params.get('to')
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else date_from + timedelta(days=6)
+    except Doctor.DoesNotExist:
+        return JsonResponse({'error': 'Doctor does not exist'}, status=404)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date format'}, status=400)
+
+    if date_to < date_from or (date_to - date_from).days >= MAX_RANGE_DAYS:
+        return JsonResponse({'error': f'Range must be from 1 to {MAX_RANGE_DAYS} days'}, status=400)
+
+    service = None
+    service_id = request.query_params.get('service')
+    if service_id:
+        service = doctor.services.filter(pk=service_id).first() if service_id.isdigit() else None
+        if service is None:
+            return JsonResponse({'error': 'Doctor does not provide this service'}, status=400)
+
+    days = get_availability(doctor, date_from, date_to, service)
+    return JsonResponse({'doctor': doctor.pk, 'days': days})
+
+
+REPORT_PARAMETERS = [
+    openapi.Parameter(
+        'from',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE,
+        description='date format: YYYY-MM-DD, 30 days before "to" by default'
+    ),
+    openapi.Parameter(
+        'to',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE,
+        description='date format: YYYY-MM-DD, today by default'
+    ),
+]
+
+
+def _report_stats(request, filters=()):
+    """
+    DailyServiceStats of the requested range, filtered by the integer query
+    parameters named in filters. Raises ValueError with a fixed message on bad parameters.
+    """
+    try:
+        date_to = request.query_params.get('to')
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else datetime.today().date()
+        date_from = request.query_params.get('from')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else date_to - timedelta(days=30)
+        lookups = {
+            name: int(request.query_params[name])
+            for name in filters if request.query_params.get(name)
+        }
+    except ValueError:
+        # текст исключений strptime/int клиенту не отдаём
+        raise ValueError('Invalid parameters') from None
+    if date_to < date_from or (date_to - date_from).days >= settings.REPORT_MAX_DAYS:
+        raise ValueError(f'Range must be from 1 to {settings.REPORT_MAX_DAYS} days')
+    return DailyServiceStats.objects.filter(date__range=(date_from, date_to), **lookups)
+
+
+def _totals(rows):
+    return rows.annotate(
+        total=Sum('count'), total_confirmed=Sum('confirmed_count'), total_revenue=Sum('revenue')
+    )
+
+
+def _counters(row):
+    return {
+        'count': row['total'],
+        'confirmed_count': row['total_confirmed'],
+        'revenue': f"{row['total_revenue']:.2f}",
+    }
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@swagger_auto_schema(manual_parameters=REPORT_PARAMETERS)
+def get_services_report(request):
+    """ Services delivered in the range, read from the daily rollups only """
+    try:
+        stats = _report_stats(request)
+    except ValueError as error:
+        return Response({'error': str(error)}, status=400)
+    rows = _totals(stats.values('service', 'service__name')).order_by('-total', 'service')
+    return Response([
+        {'service': row['service'], 'name': row['service__name'], **_counters(row)}
+        for row in rows
+    ])
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@swagger_auto_schema(
+    manual_parameters=REPORT_PARAMETERS + [
+        openapi.Parameter('doctor', in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('service', in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    ]
+)
+def get_doctors_report(request):
+    """ Services of every doctor in the range, read from the daily rollups only """
+    try:
+        stats = _report_stats(request, ('doctor', 'service'))
+    except ValueError as error:
+        return Response({'error': str(error)}, status=400)
+    rows = _totals(stats.values(
+        'doctor', 'doctor__name', 'doctor__last_name', 'service', 'service__name'
+    )).order_by('doctor', 'service')
+    doctors = {}
+    for row in rows:
+        doctor = doctors.setdefault(row['doctor'], {
+            'doctor': row['doctor'],
+            'name': row['doctor__name'],
+            'last_name': row['doctor__last_name'],
+            'services': [],
+        })
+        doctor['services'].append(
+            {'service': row['service'], 'name': row['service__name'], **_counters(row)}
+        )
+    return Response(list(doctors.values()))
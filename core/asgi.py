@@ -9,17 +9,19 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 
-from applications.notifications import routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Django должен быть инициализирован до импорта consumers (они импортируют модели)
+django_asgi_app = get_asgi_application()
+
+from applications.notifications import routing
+from applications.notifications.middleware import JWTAuthMiddleware
 
 application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
-    'websocket': AuthMiddlewareStack(
+    'http': django_asgi_app,
+    'websocket': JWTAuthMiddleware(
         URLRouter(
             routing.websocket_urlpatterns
         )
@@ -13,4 +13,20 @@ app.conf.beat_schedule = {
         'task': 'applications.services.tasks.delete_expired_bookings',
         'schedule': crontab(hour=0, minute=0),  # Запускать каждый день в полночь
     },
+    'send-booking-reminders': {
+        'task': 'applications.services.tasks.send_due_reminders',
+        'schedule': crontab(minute='*/5'),
+    },
+    'dispatch-notification-outbox': {
+        'task': 'applications.notifications.tasks.dispatch_outbox',
+        'schedule': 10.0,  # страховка, если dispatch после коммита не запустился
+    },
+    'delete-expired-codes': {
+        'task': 'applications.account.tasks.delete_expired_codes',
+        'schedule': crontab(minute=30),  # каждый час
+    },
+    'send-queued-emails': {
+        'task': 'applications.account.tasks.send_queued_emails',
+        'schedule': 60.0,  # повторные попытки и письма, не отправленные после коммита
+    },
 }
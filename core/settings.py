@@ -94,6 +94,56 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    }
+}
+
+# Кэш ответов каталога услуг и врачей (applications/services/caching.py)
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Матрица доступности врачей (applications/services/matrix.py)
+AVAILABILITY_SLOT_MINUTES = 30
+AVAILABILITY_MATRIX_TIMEOUT = 60 * 60
+AVAILABILITY_MATRIX_WEEKS = 8
+
+# Максимум записей в /booking/bulk/ и /booking/bulk-confirm/
+BOOKING_BULK_MAX_SIZE = 500
+
+# Максимальный период отчётов /reports/..., дней
+REPORT_MAX_DAYS = 366
+
+# Строк за одно чтение курсора при выгрузке /serviceHistory/export/
+EXPORT_CHUNK_SIZE = 2000
+
+# Код страны для номеров, начинающихся с 0 (models.normalize_phone)
+PHONE_COUNTRY_CODE = '996'
+
+# Импорт пациентов (applications/services/imports.py)
+PATIENT_IMPORT_BATCH_SIZE = 1000
+
+# Сколько последних записей истории показывает /patient/<id>/
+PATIENT_RECENT_HISTORY_SIZE = 10
+
+# Удаление прошедших записей (applications/services/purge.py)
+BOOKING_PURGE_BATCH_SIZE = 1000
+BOOKING_PURGE_TIME_BUDGET = 60  # секунд на один запуск задачи
+BOOKING_PURGE_PAUSE = 5  # секунд до продолжения, если бюджет исчерпан
+
+# Напоминания о записях (applications/services/reminders.py)
+BOOKING_REMINDER_LEAD_HOURS = 24  # за сколько часов до начала напоминать
+BOOKING_REMINDER_BATCH_SIZE = 500
+
+# Сколько сообщений outbox публикуется за одну транзакцию
+NOTIFICATION_OUTBOX_BATCH_SIZE = 200
+# Окно (в секундах), за которое уведомления одного врача собираются в одно сообщение
+NOTIFICATION_COALESCE_WINDOW = 0.25
+
+# Максимум неотправленных сообщений на одно websocket-соединение
+WEBSOCKET_SEND_QUEUE_SIZE = 100
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -162,10 +212,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'applications.account.authentication.CachedJWTAuthentication',
     )
 }
 
+# Кеш пользователей для CachedJWTAuthentication
+AUTH_USER_CACHE_TIMEOUT = 5 * 60  # общий кеш (Redis), секунд
+AUTH_USER_LOCAL_CACHE_SIZE = 1024  # LRU в каждом процессе
+AUTH_USER_LOCAL_CACHE_TTL = 5  # секунд, столько процесс может не видеть изменений пользователя
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
@@ -198,7 +253,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "applications.account.serializers.TokenObtainSerializer",
     "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
@@ -222,7 +277,22 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = os.environ.get('EMAIL_PORT')
 EMAIL_USE_TLS = os.environ.get('USE_TLS')
-EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND')
+EMAIL_BACKEND = os.environ.get(
+    'EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend'
+)
+# для django.core.mail.backends.filebased.EmailBackend
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', BASE_DIR / 'sent_emails')
+
+# Срок действия одноразовых кодов (applications/account/models.py::OneTimeCode), секунд
+ACTIVATION_CODE_TTL = 3 * 24 * 60 * 60
+PASSWORD_RESET_CODE_TTL = 60 * 60
+
+# Очередь писем (applications/account/tasks.py::send_queued_emails)
+EMAIL_QUEUE_BATCH_SIZE = 100
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_RETRY_DELAY = 60  # секунд до второй попытки, дальше удваивается
+EMAIL_QUEUE_RATE_LIMIT = 10  # писем в секунду, 0 - без ограничения
+EMAIL_QUEUE_COALESCE_WINDOW = 2  # секунд, письма за это окно уходят одним запуском задачи
 
 CELERY_BROKER_URL = 'redis://localhost:6379'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379'